@@ -0,0 +1,641 @@
+"""
+Benchmarks.py measures the speed and accuracy of the Fall Detection System on the bundled fall_samples videos and is
+not apart of the actual System's code base.
+
+
+
+Copyright (c) 2020 Fall Detection System, All rights reserved.
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1.	Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2.	Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer
+    in the documentation and/or other materials provided with the distribution.
+
+3.	Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import argparse
+import gc
+import json
+import numpy as np
+import platform
+import subprocess
+import sys
+import tracemalloc
+from cv2 import cv2
+from datetime import datetime
+from timeit import default_timer as timer
+
+import ComputerVision
+import Distance
+import HumanStateClassifier
+import Templates
+
+# The resource module, which gives the peak resident set size, is not available on Windows.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Whether each bundled sample video contains a fall, as expected by unit_tests.TestFallCases.
+SAMPLE_VIDEOS = {
+    './fall_samples/fall-0-5-1.mp4': True,
+    './fall_samples/fall-0-5-2.mp4': True,
+    './fall_samples/fall-5-10-1.mp4': True,
+    './fall_samples/fall-15-20-1.mp4': True,
+    './fall_samples/fall-15-20-2.mp4': True,
+    './fall_samples/fall-lowlight.mp4': True,
+    './fall_samples/fall-obstructed.mp4': True,
+    './fall_samples/dogs.mp4': False,
+    './fall_samples/human-sitting-down.mp4': False,
+    './fall_samples/human-lying-down.mp4': False,
+}
+
+# Runs a video through the same steps as ComputerVision.display(), without any windows, and returns the
+# edge and foreground crops that display() would classify.
+def extractCrops(videoPath):
+    BOUNDING_BOX_COUNT = 5
+    FRAME_INFO_COUNT = 5
+    frame_history = ComputerVision.FrameHistory(boundingBoxSaveCount=BOUNDING_BOX_COUNT, frameInfoSaveCount=FRAME_INFO_COUNT)
+
+    # Every video starts from an empty background model so that results do not depend on the order videos are run in.
+    ComputerVision.ImageManipulator.fgbg = ComputerVision.createBackgroundSubtractor()
+
+    edge_crops = []
+    foreground_crops = []
+
+    cap = cv2.VideoCapture(videoPath)
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        current_frame = ComputerVision.ImageManipulator(frame)
+        if not current_frame.check_movement_detected():
+            continue
+
+        if frame_history.bounding_box_full():
+            frame_history.forget_bounding_box(1)
+        frame_history.add_bounding_box(current_frame.get_bounding_box())
+
+        if not frame_history.check_continuous_decrease():
+            average_area = frame_history.average_area()
+            current_bounding_box = current_frame.get_bounding_box()
+
+            if current_bounding_box.get_area() < average_area:
+                width, height = frame_history.average_dimensions()
+                current_bounding_box.change_dimensions(width, height)
+                current_frame.set_bounding_box(current_bounding_box)
+                frame_history.update_bounding_box(current_bounding_box)
+
+            edge_crops.append(current_frame.extract_edges())
+            foreground_crops.append(current_frame.extract_foreground())
+
+    cap.release()
+    return edge_crops, foreground_crops
+
+# Applies the rule display() uses to decide whether a video contains a fall.
+def fallDetected(edgeClassifications, foregroundClassifications):
+    fall_counter = 0
+    for edge_classification, foreground_classification in zip(edgeClassifications, foregroundClassifications):
+        if (edge_classification == 'falling') or (foreground_classification == 'falling'):
+            fall_counter += 1
+    return fall_counter > 3
+
+# Classifies the crops one at a time, as display() does, and returns the classifications and the time taken.
+def timeClassifications(classifier, crops):
+    start = timer()
+    classifications = [classifier.classify(crop) for crop in crops]
+    return classifications, timer() - start
+
+# Compares the full resolution classifiers with classifiers working in an EigenTemplates basis.
+def benchmarkProjection(templates, dimensions = 48, k = 4, videos = SAMPLE_VIDEOS):
+    video_crops = {video_path: extractCrops(video_path) for video_path in videos}
+
+    configurations = {'full resolution': lambda: None,
+                      f'eigen-templates ({dimensions})': lambda: HumanStateClassifier.EigenTemplates(dimensions=dimensions)}
+
+    results = {}
+    for name, projection in configurations.items():
+        start = timer()
+        edge_classifier = HumanStateClassifier.KNeighborsClassifier(templates['edge'], k=k, projection=projection())
+        foreground_classifier = HumanStateClassifier.KNeighborsClassifier(templates['foreground'], k=k, projection=projection())
+        build_time = timer() - start
+
+        classification_time = 0
+        crop_count = 0
+        classifications = {}
+        verdicts = {}
+        for video_path, (edge_crops, foreground_crops) in video_crops.items():
+            edge_classifications, edge_time = timeClassifications(edge_classifier, edge_crops)
+            foreground_classifications, foreground_time = timeClassifications(foreground_classifier, foreground_crops)
+
+            classification_time += edge_time + foreground_time
+            crop_count += len(edge_crops) + len(foreground_crops)
+            classifications[video_path] = edge_classifications + foreground_classifications
+            verdicts[video_path] = fallDetected(edge_classifications, foreground_classifications)
+
+        results[name] = {'build_time': build_time,
+                         'classification_time': classification_time,
+                         'crop_count': crop_count,
+                         'classifications': classifications,
+                         'verdicts': verdicts}
+
+    printConfigurationResults(results, videos)
+    return results
+
+# Compares the exhaustive scan of every template with coarse-to-fine cascades that measure only a shortlist of each
+# size at full resolution. With templateCount set, the edge and foreground templates are each augmented to that many
+# synthetic templates first, to show how the cascade scales. The agreement and changed columns say how often the
+# cascade changes the classification of a crop and the verdict on a video.
+def benchmarkCascade(templates, shortlistSizes = (32, 128, 512), k = 4, templateCount = None, videos = SAMPLE_VIDEOS):
+    video_crops = {video_path: extractCrops(video_path) for video_path in videos}
+    if templateCount is not None:
+        templates = {template_characteristic: augmentTemplates(templates[template_characteristic], templateCount)
+                     for template_characteristic in ('edge', 'foreground')}
+
+    configurations = {'exhaustive': {'indexMode': 'exact'}}
+    for shortlist_size in shortlistSizes:
+        configurations[f'cascade ({shortlist_size})'] = {'indexMode': 'cascade', 'shortlistSize': shortlist_size}
+
+    results = {}
+    for name, configuration in configurations.items():
+        start = timer()
+        edge_classifier = HumanStateClassifier.KNeighborsClassifier(templates['edge'], k=k, **configuration)
+        foreground_classifier = HumanStateClassifier.KNeighborsClassifier(templates['foreground'], k=k, **configuration)
+        build_time = timer() - start
+
+        classification_time = 0
+        crop_count = 0
+        classifications = {}
+        verdicts = {}
+        for video_path, (edge_crops, foreground_crops) in video_crops.items():
+            edge_classifications, edge_time = timeClassifications(edge_classifier, edge_crops)
+            foreground_classifications, foreground_time = timeClassifications(foreground_classifier, foreground_crops)
+
+            classification_time += edge_time + foreground_time
+            crop_count += len(edge_crops) + len(foreground_crops)
+            classifications[video_path] = edge_classifications + foreground_classifications
+            verdicts[video_path] = fallDetected(edge_classifications, foreground_classifications)
+
+        results[name] = {'build_time': build_time,
+                         'classification_time': classification_time,
+                         'crop_count': crop_count,
+                         'classifications': classifications,
+                         'verdicts': verdicts}
+        del edge_classifier, foreground_classifier
+        gc.collect()
+
+    printConfigurationResults(results, videos)
+    return results
+
+# Prints the speed and verdicts of each classifier configuration against the first one, which is the reference.
+def printConfigurationResults(results, videos):
+    reference = next(iter(results.values()))
+
+    print(f"{'configuration':<24}{'build (s)':>10}{'ms/crop':>10}{'speedup':>10}{'agreement':>11}{'changed':>9}{'verdicts':>10}")
+    for name, result in results.items():
+        ms_per_crop = 1000 * result['classification_time'] / max(1, result['crop_count'])
+        speedup = reference['classification_time'] / max(result['classification_time'], 1e-9)
+
+        agreeing = 0
+        for video_path, classifications in result['classifications'].items():
+            agreeing += sum(a == b for a, b in zip(classifications, reference['classifications'][video_path]))
+        agreement = agreeing / max(1, result['crop_count'])
+
+        correct = sum(result['verdicts'][video_path] == expected for video_path, expected in videos.items())
+        changed = sum(result['verdicts'][video_path] != reference['verdicts'][video_path] for video_path in videos)
+
+        print(f"{name:<24}{result['build_time']:>10.2f}{ms_per_crop:>10.3f}{speedup:>9.1f}x{agreement:>10.1%}"
+              f"{changed:>6}/{len(videos)}{correct:>7}/{len(videos)}")
+
+    print()
+    print(f"{'video':<40}" + "".join(f"{name:>26}" for name in results) + f"{'expected':>10}")
+    for video_path, expected in videos.items():
+        verdicts = "".join(f"{'fall' if result['verdicts'][video_path] else 'no fall':>26}" for result in results.values())
+        print(f"{video_path:<40}{verdicts}{'fall' if expected else 'no fall':>10}")
+
+# Times decoding the local template images with each number of decode workers.
+def benchmarkTemplateLoading(workerCounts = (1, 2, 4, 8, 16), repeats = 3):
+    image_paths = Templates.templateImagePaths()
+
+    results = {}
+    for workers in workerCounts:
+        seconds = []
+        for _ in range(repeats):
+            Templates.loadTemplateImages(image_paths, workers)
+            seconds.append(Templates.load_metrics[-1].seconds)
+        results[workers] = min(seconds)
+
+    print(f"{'workers':>8}{'seconds':>10}{'speedup':>10}")
+    for workers, seconds in results.items():
+        print(f"{workers:>8}{seconds:>10.3f}{results[workerCounts[0]] / seconds:>9.1f}x")
+    return results
+
+# Runs the videos headless with the movement found at each motion scale, and compares frame rates and verdicts.
+def benchmarkMotionScale(templates, motionScales = (1, 2, 4), roiOnly = False, k = 4, videos = SAMPLE_VIDEOS):
+    edge_classifier = HumanStateClassifier.KNeighborsClassifier(templates['edge'], k=k)
+    foreground_classifier = HumanStateClassifier.KNeighborsClassifier(templates['foreground'], k=k)
+
+    results = {}
+    for motion_scale in motionScales:
+        frames = 0
+        verdicts = {}
+        start = timer()
+        for video_path in videos:
+            frame_results = list(ComputerVision.processHeadless(foreground_classifier, edge_classifier, videoPath=video_path,
+                                                                backgroundSubtractor=ComputerVision.createBackgroundSubtractor(),
+                                                                printFrameRate=False, roiOnly=roiOnly, motionScale=motion_scale))
+            frames += len(frame_results)
+            verdicts[video_path] = ComputerVision.fallDetected(frame_results)
+        results[motion_scale] = {'seconds': timer() - start, 'frames': frames, 'verdicts': verdicts}
+
+    reference = results[motionScales[0]]
+    print(f"{'scale':>6}{'fps':>8}{'speedup':>10}{'correct':>10}{'same as 1/' + str(motionScales[0]):>12}")
+    for motion_scale, result in results.items():
+        fps = result['frames'] / result['seconds']
+        speedup = reference['seconds'] / result['seconds']
+        correct = sum(result['verdicts'][video_path] == expected for video_path, expected in videos.items())
+        same = sum(result['verdicts'][video_path] == reference['verdicts'][video_path] for video_path in videos)
+        print(f"{'1/' + str(motion_scale):>6}{fps:>8.1f}{speedup:>9.1f}x{correct:>7}/{len(videos)}{same:>9}/{len(videos)}")
+
+    print()
+    print(f"{'video':<40}" + "".join(f"{'1/' + str(motion_scale):>10}" for motion_scale in results) + f"{'expected':>10}")
+    for video_path, expected in videos.items():
+        verdicts = "".join(f"{'fall' if result['verdicts'][video_path] else 'no fall':>10}" for result in results.values())
+        print(f"{video_path:<40}{verdicts}{'fall' if expected else 'no fall':>10}")
+    return results
+
+# Returns the bytes and the number of memory blocks that are still allocated for what build() returns.
+def measureAllocations(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    built = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    statistics = after.compare_to(before, 'filename')
+    del built
+    return sum(statistic.size_diff for statistic in statistics), sum(statistic.count_diff for statistic in statistics)
+
+# Compares count BoundingBox, FrameInfo and DistanceAndClass objects with the same values built at once as record
+# arrays: the memory and allocations they keep and the time taken to build them.
+def benchmarkRecords(count = 100000, repeats = 3):
+    random = np.random.default_rng(450)
+    coordinates = random.integers(0, 640, (6, count), dtype=np.int32)
+    distances = random.random(count) * 10000
+    labels = random.integers(0, 4, count)
+    classes = ['upright', 'falling', 'sitting', 'lying']
+
+    # The objects are built from Python values, as they are in the frame loop.
+    coordinate_lists = coordinates.tolist()
+    distance_list = distances.tolist()
+    label_list = labels.tolist()
+
+    builders = {'BoundingBox objects': lambda: [ComputerVision.BoundingBox(*values) for values in zip(*coordinate_lists)],
+                'BoundingBox records': lambda: ComputerVision.boundingBoxRecords(*coordinates),
+                'FrameInfo objects': lambda: [ComputerVision.FrameInfo(classes[edge], classes[foreground])
+                                              for edge, foreground in zip(label_list, reversed(label_list))],
+                'DistanceAndClass objects': lambda: [HumanStateClassifier.DistanceAndClass(distance, classes[label])
+                                                     for distance, label in zip(distance_list, label_list)],
+                'DistanceAndClass records': lambda: HumanStateClassifier.distanceAndClassRecords(distances, labels)}
+
+    results = {}
+    for name, build in builders.items():
+        seconds = []
+        for _ in range(repeats):
+            start = timer()
+            build()
+            seconds.append(timer() - start)
+        size, blocks = measureAllocations(build)
+        results[name] = {'bytes': size / count, 'blocks': blocks / count, 'ns': 1e9 * min(seconds) / count}
+
+    print(f"{'representation':<28}{'bytes/item':>12}{'allocs/item':>13}{'ns/item':>10}")
+    for name, result in results.items():
+        print(f"{name:<28}{result['bytes']:>12.1f}{result['blocks']:>13.3f}{result['ns']:>10.1f}")
+    return results
+
+# Template counts the classification benchmark of the suite scales the real template set up to.
+SUITE_TEMPLATE_COUNTS = (1000, 10000, 100000)
+
+# Peak resident set size of this process in MB so far, or None where it cannot be read.
+def peakMemoryMB():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+# The commit the benchmarks ran on, or None outside of a git checkout.
+def currentCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError) as error:
+        print(error)
+        return None
+
+# Makes count synthetic templates from the real templates of one characteristic, in the same proportions of
+# classes. Each is a real template shifted by up to 3 pixels, mirrored half of the time, with 1% of its pixels
+# flipped between black and white, so the synthetic set is as hard to search as a larger real one would be.
+def augmentTemplates(classTemplates, count, seed = 450):
+    random = np.random.default_rng(seed)
+    class_stacks = {template_type: np.asarray(templates) for template_type, templates in classTemplates.items() if len(templates) > 0}
+    total = sum(len(stack) for stack in class_stacks.values())
+
+    augmented = {}
+    remaining = count
+    for class_index, (template_type, stack) in enumerate(class_stacks.items()):
+        class_count = remaining if class_index == len(class_stacks) - 1 else round(count * len(stack) / total)
+        remaining -= class_count
+
+        sources = random.integers(0, len(stack), class_count)
+        shifts = random.integers(-3, 4, (class_count, 2))
+        mirrored = random.random(class_count) < 0.5
+
+        # The flipped pixels are drawn one template at a time, so the synthetic set is the largest array made.
+        templates = np.empty((class_count,) + stack.shape[1:], dtype=stack.dtype)
+        for index, source in enumerate(sources):
+            template = np.roll(stack[source], tuple(shifts[index]), axis=(0, 1))
+            template = template[:, ::-1] if mirrored[index] else template
+            flipped = random.random(template.shape) < 0.01
+            templates[index] = np.where(flipped, 255 - template, template)
+        augmented[template_type] = templates
+
+    return augmented
+
+# Frames per second of the ImageManipulator steps alone: the gray filter, MOG2, focus_movement() and, on frames with
+# movement, the edge and foreground crops. Reading the frames is not timed.
+def benchmarkImageManipulator(videos = SAMPLE_VIDEOS, frameLimit = None):
+    frames = 0
+    crops = 0
+    seconds = 0.0
+    for video_path in videos:
+        background_subtractor = ComputerVision.createBackgroundSubtractor()
+        cap = cv2.VideoCapture(video_path)
+        video_frames = 0
+        while cap.isOpened() and (frameLimit is None or video_frames < frameLimit):
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            start = timer()
+            current_frame = ComputerVision.ImageManipulator(frame, background_subtractor)
+            if current_frame.check_movement_detected():
+                current_frame.extract_edges()
+                current_frame.extract_foreground()
+                crops += 1
+            seconds += timer() - start
+            video_frames += 1
+        cap.release()
+        frames += video_frames
+
+    return {'frames': frames, 'crops': crops, 'seconds': seconds, 'fps': frames / seconds if seconds > 0 else 0.0}
+
+# Latency of every frame through the whole headless pipeline, reading and classifying included, and the verdicts.
+def benchmarkPipeline(templates, videos = SAMPLE_VIDEOS, k = 4, metric = 'l2'):
+    edge_classifier = HumanStateClassifier.KNeighborsClassifier(templates['edge'], k=k, metric=metric)
+    foreground_classifier = HumanStateClassifier.KNeighborsClassifier(templates['foreground'], k=k, metric=metric)
+
+    frame_latencies = []
+    correct = 0
+    for video_path, expected in videos.items():
+        frame_results = []
+        frame_start = timer()
+        for result in ComputerVision.processHeadless(foreground_classifier, edge_classifier, videoPath=video_path,
+                                                     backgroundSubtractor=ComputerVision.createBackgroundSubtractor(),
+                                                     printFrameRate=False):
+            frame_end = timer()
+            frame_latencies.append(frame_end - frame_start)
+            frame_results.append(result)
+            frame_start = frame_end
+        correct += ComputerVision.fallDetected(frame_results) == expected
+
+    seconds = sum(frame_latencies)
+    latencies = np.array(frame_latencies) if len(frame_latencies) > 0 else np.zeros(1)
+    return {'frames': len(frame_latencies),
+            'seconds': seconds,
+            'fps': len(frame_latencies) / seconds if seconds > 0 else 0.0,
+            'p50_ms': 1000 * float(np.percentile(latencies, 50)),
+            'p95_ms': 1000 * float(np.percentile(latencies, 95)),
+            'p99_ms': 1000 * float(np.percentile(latencies, 99)),
+            'correct': int(correct),
+            'videos': len(videos)}
+
+# Classifications per second of one characteristic against each number of synthetic templates, measured with the
+# given distance metric. The same testingCount synthetic crops are classified with classify_many() at every count.
+# With binary set the synthetic templates are bit-packed before the classifier is built.
+def benchmarkClassification(templates, templateCounts = SUITE_TEMPLATE_COUNTS, characteristic = 'foreground', testingCount = 32, k = 4,
+                            metric = 'l2', binary = False):
+    testing_items = np.concatenate(list(augmentTemplates(templates[characteristic], testingCount, seed=451).values()))
+
+    results = {}
+    for template_count in templateCounts:
+        training_dataset = augmentTemplates(templates[characteristic], template_count)
+        if binary:
+            training_dataset = {template_type: Distance.binaryTemplates(images)
+                                for template_type, images in training_dataset.items()}
+        start = timer()
+        classifier = HumanStateClassifier.KNeighborsClassifier(training_dataset, k=k, metric=metric)
+        build_seconds = timer() - start
+        del training_dataset
+
+        start = timer()
+        classifier.classify_many(testing_items)
+        seconds = timer() - start
+
+        results[str(template_count)] = {'build_seconds': build_seconds,
+                                        'template_mb': classifier.training_matrix.nbytes / 2 ** 20,
+                                        'seconds': seconds,
+                                        'per_second': len(testing_items) / seconds if seconds > 0 else 0.0}
+        del classifier
+        gc.collect()
+    return results
+
+# An empty templates dict for TemplateDatabase.load_templates() to fill.
+def emptyTemplates():
+    return {template_characteristic: {template_type: [] for template_type in Templates.TEMPLATE_TYPES}
+            for template_characteristic in Templates.TEMPLATE_CHARACTERISTICS}
+
+# Seconds taken to load the templates from their PNG images, from the template pack and, when a connected
+# TemplateDatabase is given, from the template table. The fastest of repeats loads is kept for each source.
+def benchmarkTemplateSources(database = None, repeats = 3):
+    sources = {'png': lambda: Templates.loadTemplatesLocally(usePack=False),
+               'pack': lambda: Templates.loadTemplatesLocally(),
+               'binary pack': lambda: Templates.loadTemplatesLocally(binary=True)}
+    if database is not None and database.connected():
+        sources['database'] = lambda: database.load_templates(emptyTemplates())
+
+    results = {}
+    for source, load in sources.items():
+        seconds = []
+        for _ in range(repeats):
+            start = timer()
+            templates = load()
+            seconds.append(timer() - start)
+        template_count = sum(len(type_templates) for characteristic_templates in templates.values()
+                             for type_templates in characteristic_templates.values())
+        results[source] = {'templates': template_count, 'seconds': min(seconds)}
+    return results
+
+# Runs the whole benchmark suite and writes its results, with the commit and the versions they were measured on, to
+# a JSON file at outputPath. Template loading is measured first and the largest template count last, so the peak
+# memory recorded after each part shows what that part added. The classifiers measure distances with metric, or
+# compare bit-packed templates with Hamming distance when binary is set.
+def runSuite(outputPath = None, videos = SAMPLE_VIDEOS, templateCounts = SUITE_TEMPLATE_COUNTS, database = None, frameLimit = None,
+             characteristic = 'foreground', metric = 'l2', binary = False):
+    if binary:
+        metric = 'hamming'
+    suite = {'commit': currentCommit(),
+             'metric': metric,
+             'binary': binary,
+             'timestamp': datetime.now().isoformat(timespec='seconds'),
+             'python': platform.python_version(),
+             'numpy': np.__version__,
+             'opencv': cv2.__version__,
+             'platform': platform.platform(),
+             'results': {}}
+    results = suite['results']
+
+    results['loading'] = benchmarkTemplateSources(database)
+    results['loading']['peak_rss_mb'] = peakMemoryMB()
+    templates = Templates.loadTemplatesLocally()
+
+    results['image_manipulator'] = benchmarkImageManipulator(videos, frameLimit)
+    results['image_manipulator']['peak_rss_mb'] = peakMemoryMB()
+
+    results['pipeline'] = benchmarkPipeline(Templates.binarizeTemplates(templates) if binary else templates, videos,
+                                             metric=metric)
+    results['pipeline']['peak_rss_mb'] = peakMemoryMB()
+
+    results['classification'] = benchmarkClassification(templates, templateCounts, characteristic, metric=metric,
+                                                        binary=binary)
+    results['classification']['peak_rss_mb'] = peakMemoryMB()
+
+    if outputPath is not None:
+        try:
+            with open(outputPath, 'w') as output_file:
+                json.dump(suite, output_file, indent=2)
+        except OSError as error:
+            print(error)
+    return suite
+
+# Flattens nested results to {'pipeline.p95_ms': value, ...} for comparison.
+def suiteMetrics(results, prefix = ''):
+    metrics = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(suiteMetrics(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[prefix + name] = value
+    return metrics
+
+# Whether a larger value of the metric is better: rates and the number of correct verdicts.
+def higherIsBetter(metric):
+    return metric.endswith(('fps', 'per_second', 'correct'))
+
+# Metrics that say how fast or how large something is, rather than how much work was done.
+def measuredMetric(metric):
+    return higherIsBetter(metric) or metric.endswith(('seconds', '_ms', '_mb'))
+
+# Prints every measured metric of two suites side by side and returns the names of those that became worse by more
+# than tolerance, as a fraction of the baseline.
+def compareSuites(baseline, current, tolerance = 0.1):
+    baseline_metrics = suiteMetrics(baseline['results'])
+    current_metrics = suiteMetrics(current['results'])
+
+    print(f"{'metric':<44}{'baseline':>12}{'current':>12}{'change':>9}")
+    regressions = []
+    for metric, current_value in current_metrics.items():
+        baseline_value = baseline_metrics.get(metric)
+        if baseline_value is None or not measuredMetric(metric):
+            continue
+
+        change = (current_value - baseline_value) / baseline_value if baseline_value != 0 else 0.0
+        worse = -change if higherIsBetter(metric) else change
+        regressed = worse > tolerance
+        if regressed:
+            regressions.append(metric)
+        print(f"{metric:<44}{baseline_value:>12.3f}{current_value:>12.3f}{change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+
+    print(f"\n{len(regressions)} regressions beyond {tolerance:.0%} against commit {baseline.get('commit')}.")
+    return regressions
+
+def printSuite(suite):
+    print(f"Commit {suite['commit']}, metric {suite.get('metric', 'l2')}, Python {suite['python']}, numpy {suite['numpy']}, OpenCV {suite['opencv']}")
+    for metric, value in suiteMetrics(suite['results']).items():
+        print(f"{metric:<44}{value:>12.3f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fall Detection System benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    projection_parser = subparsers.add_parser('projection', help='Full resolution KNN against KNN on eigen-templates.')
+    projection_parser.add_argument('--dimensions', type=int, default=48)
+    projection_parser.add_argument('--k', type=int, default=4)
+
+    cascade_parser = subparsers.add_parser('cascade', help='Exhaustive KNN against coarse-to-fine cascades over template thumbnails.')
+    cascade_parser.add_argument('--shortlists', type=int, nargs='+', default=[32, 128, 512], help='Shortlist sizes to compare.')
+    cascade_parser.add_argument('--template-count', type=int, default=None, help='Augment the edge and foreground templates to this many each.')
+    cascade_parser.add_argument('--k', type=int, default=4)
+
+    loading_parser = subparsers.add_parser('loading', help='Template image decoding with different numbers of workers.')
+    loading_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+
+    motion_scale_parser = subparsers.add_parser('motion-scale', help='Movement found on scaled down frames against full resolution.')
+    motion_scale_parser.add_argument('--scales', type=int, nargs='+', choices=[1, 2, 4], default=[1, 2, 4])
+    motion_scale_parser.add_argument('--roi', action='store_true', help='Process only the region of interest around each bounding box.')
+
+    records_parser = subparsers.add_parser('records', help='Memory and allocations of record objects against record arrays.')
+    records_parser.add_argument('--count', type=int, default=100000)
+
+    suite_parser = subparsers.add_parser('suite', help='CV frame rates, pipeline latency, KNN scaling, template loading and peak memory.')
+    suite_parser.add_argument('--output', default='benchmark_results.json', help='JSON file the results are written to.')
+    suite_parser.add_argument('--baseline', default=None, help='Results of an earlier run to compare with. Exits with status 1 on a regression.')
+    suite_parser.add_argument('--tolerance', type=float, default=0.1, help='Fraction a metric may become worse by before it is a regression.')
+    suite_parser.add_argument('--template-counts', type=int, nargs='+', default=list(SUITE_TEMPLATE_COUNTS))
+    suite_parser.add_argument('--characteristic', choices=Templates.TEMPLATE_CHARACTERISTICS, default='foreground')
+    suite_parser.add_argument('--metric', choices=Distance.METRICS, default='l2', help='Distance metric of the classifiers.')
+    suite_parser.add_argument('--binary', action='store_true', help='Bit-pack the templates and measure them with Hamming distance.')
+    suite_parser.add_argument('--frames', type=int, default=None, help='Frames of each video for the ImageManipulator benchmark.')
+    suite_parser.add_argument('--database', default=None, help='Template database to time loading from.')
+    suite_parser.add_argument('--password', default='')
+
+    arguments = parser.parse_args()
+
+    if arguments.benchmark == 'projection':
+        benchmarkProjection(Templates.loadTemplatesLocally(), dimensions=arguments.dimensions, k=arguments.k)
+    elif arguments.benchmark == 'cascade':
+        benchmarkCascade(Templates.loadTemplatesLocally(), shortlistSizes=tuple(arguments.shortlists), k=arguments.k,
+                         templateCount=arguments.template_count)
+    elif arguments.benchmark == 'loading':
+        benchmarkTemplateLoading(tuple(arguments.workers))
+    elif arguments.benchmark == 'motion-scale':
+        benchmarkMotionScale(Templates.loadTemplatesLocally(), motionScales=tuple(arguments.scales), roiOnly=arguments.roi)
+    elif arguments.benchmark == 'records':
+        benchmarkRecords(arguments.count)
+    elif arguments.benchmark == 'suite':
+        database = None
+        if arguments.database is not None:
+            database = Templates.TemplateDatabase(arguments.database, arguments.password)
+            database.connect()
+
+        suite = runSuite(arguments.output, templateCounts=tuple(arguments.template_counts), database=database,
+                         frameLimit=arguments.frames, characteristic=arguments.characteristic, metric=arguments.metric,
+                         binary=arguments.binary)
+        printSuite(suite)
+
+        if arguments.baseline is not None:
+            with open(arguments.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+            sys.exit(1 if len(compareSuites(baseline, suite, arguments.tolerance)) > 0 else 0)
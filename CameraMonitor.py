@@ -0,0 +1,292 @@
+"""
+CameraMonitor.py watches many camera feeds, or video files standing in for cameras, from one process.
+
+
+
+Copyright (c) 2020 Fall Detection System, All rights reserved.
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1.	Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2.	Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer
+    in the documentation and/or other materials provided with the distribution.
+
+3.	Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import argparse
+import numpy as np
+from cv2 import cv2
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from queue import Empty, Full
+from timeit import default_timer as timer
+import threading
+
+import ComputerVision
+import Distance
+import HumanStateClassifier
+import Profiler
+import Templates
+
+"""
+CameraStream is one monitored feed. It has its own background model, FrameHistory and fall counter through its
+FrameProcessor, and a capture thread that keeps its FrameQueue filled. A video file standing in for a camera is
+read with the 'block' policy so that every frame is processed; a camera drops its oldest frames when the monitor
+falls behind. With motionGate set, the stream has its own MotionGate, which skips the frames of its static scenes.
+With profile set, the stream has its own Profiler, which times reading and every per frame step of the stream.
+"""
+class CameraStream:
+
+    def __init__(self, name, source, foregroundClassifier, edgeClassifier, queueSize = 4, dropPolicy = None, roiOnly = False, motionScale = 1,
+                 motionGate = False, profile = False):
+        self.name = name
+        self.source = source
+        if dropPolicy is None:
+            dropPolicy = 'drop-oldest' if isinstance(source, int) else 'block'
+
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            print(f"Error opening video stream or file for {name}")
+
+        self.profiler = Profiler.Profiler(name, enabled=profile)
+        self.frame_processor = ComputerVision.FrameProcessor(foregroundClassifier, edgeClassifier, checkTemplate=True,
+                                                             printClassifications=False,
+                                                             backgroundSubtractor=ComputerVision.createBackgroundSubtractor(),
+                                                             roiOnly=roiOnly, motionScale=motionScale,
+                                                             motionGate=ComputerVision.MotionGate() if motionGate else None,
+                                                             profiler=self.profiler)
+        self.frame_queue = ComputerVision.FrameQueue(queueSize, dropPolicy)
+        self.counters = ComputerVision.StageCounters(name)
+        self.finished = False
+        self.thread = None
+
+    def start(self, stopping, frameReady):
+        self.thread = threading.Thread(target=self.capture_frames, args=(stopping, frameReady), daemon=True)
+        self.thread.start()
+
+    def capture_frames(self, stopping, frameReady):
+        frame_count = 0
+        try:
+            while self.capture.isOpened() and not stopping.is_set():
+                with self.profiler.stage('read'):
+                    ret, frame = self.capture.read()
+                if not ret:
+                    break
+
+                if not self.put((frame_count, frame), stopping):
+                    break
+                frameReady.set()
+                frame_count += 1
+        finally:
+            self.put(ComputerVision.FrameQueue.END, stopping)
+            frameReady.set()
+            self.capture.release()
+
+    # Adds an item to the frame queue, giving up once the monitor is stopping.
+    def put(self, item, stopping):
+        while not stopping.is_set():
+            try:
+                self.frame_queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def fall_detected(self):
+        return self.frame_processor.fall_detected()
+
+    def skipped(self):
+        motion_gate = self.frame_processor.motion_gate
+        return motion_gate.skipped if motion_gate is not None else 0
+
+"""
+CameraMonitor runs the FrameProcessors of many CameraStreams. Each round takes at most one queued frame from every
+stream, runs the per frame steps of those streams on a worker pool and then classifies the crops of all of them
+together with KNeighborsClassifier.classify_many(), so the classifiers are shared and only read. A stream's frames
+are processed in order, one round at a time, so each stream gives the same results as processing it on its own.
+With profile set, the streams time their own steps and the monitor times the batched classifications.
+"""
+class CameraMonitor:
+
+    def __init__(self, sources, foregroundClassifier, edgeClassifier, workers = None, queueSize = 4, roiOnly = False, motionScale = 1,
+                 motionGate = False, profile = False):
+        self.foreground_classifier = foregroundClassifier
+        self.edge_classifier = edgeClassifier
+        self.streams = [CameraStream(name, source, foregroundClassifier, edgeClassifier, queueSize=queueSize,
+                                     roiOnly=roiOnly, motionScale=motionScale, motionGate=motionGate, profile=profile)
+                        for name, source in sources.items()]
+        self.profiler = Profiler.Profiler('monitor', enabled=profile)
+        self.workers = workers if workers is not None else min(len(self.streams), cpu_count())
+
+        self.stopping = threading.Event()
+        self.frame_ready = threading.Event()
+        self.rounds = 0
+        self.batch_sizes = []
+
+    # Yields (stream name, FrameResult) for every processed frame until every stream has ended or stop() is called.
+    def results(self):
+        for stream in self.streams:
+            stream.start(self.stopping, self.frame_ready)
+
+        start = timer()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+                while not self.stopping.is_set():
+                    ready = self.ready_frames()
+                    if ready is None:
+                        break
+                    if len(ready) == 0:
+                        self.frame_ready.wait(0.1)
+                        continue
+
+                    results = list(executor.map(self.extract, ready))
+                    self.classify(ready, results)
+                    self.rounds += 1
+
+                    for (stream, _), result in zip(ready, results):
+                        # Results are kept by the caller, so they do not hold on to the frame images.
+                        result.image_manipulator = None
+                        self.report_fall(stream, result)
+                        yield stream.name, result
+        finally:
+            self.stop()
+            for stream in self.streams:
+                stream.thread.join()
+            self.print_counters(timer() - start)
+
+    # Runs until every stream has ended and returns whether a fall was detected on each stream.
+    def run(self):
+        for _ in self.results():
+            pass
+        return {stream.name: stream.fall_detected() for stream in self.streams}
+
+    def stop(self):
+        self.stopping.set()
+
+    # Takes the next frame of every stream that has one. Returns None once every stream has ended.
+    def ready_frames(self):
+        self.frame_ready.clear()
+        ready = []
+        for stream in self.streams:
+            if stream.finished:
+                continue
+            try:
+                item = stream.frame_queue.get_nowait()
+            except Empty:
+                continue
+
+            if item is ComputerVision.FrameQueue.END:
+                stream.finished = True
+            else:
+                ready.append((stream, item))
+
+        if len(ready) == 0 and all(stream.finished for stream in self.streams):
+            return None
+        return ready
+
+    def extract(self, streamFrame):
+        stream, (frame_count, frame) = streamFrame
+        start = timer()
+        result = stream.frame_processor.extract(frame, frame_count)
+        stream.counters.record(timer() - start)
+        return result
+
+    # Classifies the crops of every stream in the round with one classify_many() call per classifier.
+    def classify(self, ready, results):
+        cropped = [(stream, result) for (stream, _), result in zip(ready, results) if result.cropped]
+        if len(cropped) == 0:
+            return
+        self.batch_sizes.append(len(cropped))
+
+        with self.profiler.stage('edge classify'):
+            edge_classifications = classifyCrops(self.edge_classifier, [result.edge_crop for _, result in cropped])
+        with self.profiler.stage('foreground classify'):
+            foreground_classifications = classifyCrops(self.foreground_classifier, [result.foreground_crop for _, result in cropped])
+
+        for (stream, result), edge_classification, foreground_classification in zip(cropped, edge_classifications, foreground_classifications):
+            stream.frame_processor.record_classifications(result, edge_classification, foreground_classification)
+
+    # Reports a fall as soon as the stream's FallEventDetector confirms it.
+    def report_fall(self, stream, result):
+        if result.fall_event is not None:
+            print(f"{stream.name}: {result.fall_event}")
+
+    # The profile summary rows of every stream followed by those of the monitor.
+    def profile_summary(self):
+        rows = []
+        for stream in self.streams:
+            rows.extend(stream.profiler.summary())
+        rows.extend(self.profiler.summary())
+        return rows
+
+    def print_counters(self, seconds):
+        frames = sum(stream.counters.frames for stream in self.streams)
+        average_batch = np.mean(self.batch_sizes) if len(self.batch_sizes) > 0 else 0
+        print(f"Monitored {len(self.streams)} streams: {frames} frames in {seconds:.2f} s "
+              f"({frames / seconds if seconds > 0 else 0:.1f} frames/s), {self.rounds} rounds, {average_batch:.1f} crops per batch.")
+        for stream in self.streams:
+            print(f"{stream.counters}  dropped {stream.frame_queue.dropped}  skipped {stream.skipped()}  "
+                  f"fall events {len(stream.frame_processor.fall_events())}  {'fall' if stream.fall_detected() else 'no fall'}")
+
+# Classifies a list of crops, as classify() would one at a time. Missing crops are classified on their own.
+def classifyCrops(classifier, crops):
+    classifications = [None] * len(crops)
+    present = [index for index, crop in enumerate(crops) if crop is not None]
+
+    if len(present) > 0:
+        present_classifications, _ = classifier.classify_many(np.stack([crops[index] for index in present]))
+        for index, classification in zip(present, present_classifications):
+            classifications[index] = classification
+
+    for index, crop in enumerate(crops):
+        if crop is None:
+            classifications[index] = classifier.classify(None)
+
+    return classifications
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monitors several cameras, or videos standing in for cameras, for falls.')
+    parser.add_argument('sources', nargs='+', help='Camera indices or video file paths.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--roi', action='store_true', help='Process only the region of interest around each bounding box.')
+    parser.add_argument('--motion-scale', type=int, choices=[1, 2, 4], default=1, help='Find movement on a frame scaled down by this factor.')
+    parser.add_argument('--motion-gate', action='store_true', help='Skip the frames of a static scene.')
+    parser.add_argument('--edge-metric', choices=Distance.METRICS, default='l2', help='Distance metric of the edge classifier.')
+    parser.add_argument('--foreground-metric', choices=Distance.METRICS, default='l2', help='Distance metric of the foreground classifier.')
+    parser.add_argument('--binary', action='store_true', help='Load bit-packed templates and compare them with Hamming distance.')
+    parser.add_argument('--shortlist', type=int, default=None,
+                        help='Shortlist this many templates by their thumbnails and measure only those at full resolution.')
+    parser.add_argument('--profile', metavar='PATH', default=None, help='Time every stage and write the summary to a .csv or .json file.')
+    arguments = parser.parse_args()
+
+    if arguments.binary:
+        arguments.edge_metric = arguments.foreground_metric = 'hamming'
+
+    templates = Templates.loadTemplatesLocally(binary=arguments.binary)
+    index_mode = 'exact' if arguments.shortlist is None else 'cascade'
+    edge_classifier = HumanStateClassifier.KNeighborsClassifier(templates['edge'], k=arguments.k, metric=arguments.edge_metric,
+                                                                indexMode=index_mode, shortlistSize=arguments.shortlist)
+    foreground_classifier = HumanStateClassifier.KNeighborsClassifier(templates['foreground'], k=arguments.k,
+                                                                      metric=arguments.foreground_metric, indexMode=index_mode,
+                                                                      shortlistSize=arguments.shortlist)
+
+    sources = {source: int(source) if source.isdigit() else source for source in arguments.sources}
+    monitor = CameraMonitor(sources, foreground_classifier, edge_classifier, workers=arguments.workers, roiOnly=arguments.roi,
+                            motionScale=arguments.motion_scale, motionGate=arguments.motion_gate,
+                            profile=arguments.profile is not None)
+    monitor.run()
+    if arguments.profile is not None:
+        rows = monitor.profile_summary()
+        Profiler.printSummary(rows)
+        Profiler.exportSummary(rows, arguments.profile)
@@ -27,13 +27,17 @@ POSSIBILITY OF SUCH DAMAGE.
 
 import numpy as np
 from cv2 import cv2
-from queue import Queue 
+from datetime import datetime
+from queue import Empty, Full, Queue
 from timeit import default_timer as timer
+import threading
 
 from imutils.object_detection import non_max_suppression
 from imutils import paths
 import imutils
 
+import Profiler
+
 SCREEN_WIDTH = 640
 SCREEN_HEIGHT = 480
 
@@ -43,6 +47,9 @@ BoundingBox referenced and defined in section 2.0 of the SDD, A03_SDD_Team4.docx
 """
 
 class BoundingBox:
+
+    # A BoundingBox is made for every frame with movement, so it keeps its fields in slots rather than a dict.
+    __slots__ = ('x1', 'x2', 'y1', 'y2', 'width', 'height')
     
     def __init__(self, x1, x2, y1, y2, width, height):
         self.x1 = x1
@@ -93,12 +100,28 @@ class BoundingBox:
 
         self.y2 = y_center + (height//2)
         if self.y2 < 0 or self.y2 > SCREEN_HEIGHT: self.y2 = SCREEN_HEIGHT
+# Record type for many bounding boxes at once, with the fields of BoundingBox.
+BOUNDING_BOX_DTYPE = np.dtype([(field, np.int32) for field in BoundingBox.__slots__])
+
+# Builds a record array of bounding boxes from matching coordinate and dimension arrays, without a BoundingBox per box.
+def boundingBoxRecords(x1, x2, y1, y2, width, height):
+    records = np.empty(np.shape(x1), dtype=BOUNDING_BOX_DTYPE)
+    records['x1'] = x1
+    records['x2'] = x2
+    records['y1'] = y1
+    records['y2'] = y2
+    records['width'] = width
+    records['height'] = height
+    return records
+
 """
 FrameInfo referenced and defined in section 2.0 of the SDD, A03_SDD_Team4.docx. 
 
 """
 class FrameInfo:
 
+    __slots__ = ('edge_classification', 'foreground_classification')
+
     def __init__(self, edgeClassification, foregroundClassification):
         self.edge_classification = edgeClassification
         self.foreground_classification = foregroundClassification
@@ -115,88 +138,257 @@ FrameHistory referenced and defined in section 2.0 of the SDD, A03_SDD_Team4.doc
 
 class FrameHistory:
 
+    # Codes the classifications are stored as; NO_CLASSIFICATION marks a frame that was not classified.
+    CLASSIFICATIONS = ('upright', 'falling', 'sitting', 'lying', 'unrecognized')
+    NO_CLASSIFICATION = -1
+    FALLING = CLASSIFICATIONS.index('falling')
+    # A frame is in the first state of STATE_ORDER that its edge or foreground classification has, as in FrameResult.state().
+    # Falling first, then upright, sitting, lying and unrecognized.
+    STATE_ORDER = (1, 0, 2, 3, 4)
+
+    # The bounding boxes and frame classifications are kept in ring buffers of preallocated arrays holding the last
+    # boundingBoxSaveCount boxes and frameInfoSaveCount classifications, so adding and forgetting frames does not
+    # allocate and the averages are taken over the arrays, whatever the length of the window.
     def __init__(self, boundingBoxSaveCount = 10, frameInfoSaveCount = 10):
 
         self.bounding_box_save_count = boundingBoxSaveCount
-        self.bounding_boxes = np.array([])
+        self.x1 = np.zeros(boundingBoxSaveCount, dtype=np.int32)
+        self.y1 = np.zeros(boundingBoxSaveCount, dtype=np.int32)
+        self.x2 = np.zeros(boundingBoxSaveCount, dtype=np.int32)
+        self.y2 = np.zeros(boundingBoxSaveCount, dtype=np.int32)
+        self.widths = np.zeros(boundingBoxSaveCount, dtype=np.int32)
+        self.heights = np.zeros(boundingBoxSaveCount, dtype=np.int32)
+        self.areas = np.zeros(boundingBoxSaveCount, dtype=np.float64)
+        self.bounding_box_start = 0
+        self.bounding_box_count = 0
 
         self.frame_info_save_count = frameInfoSaveCount
-        self.frame_classifications = np.array([])
+        self.edge_classifications = np.full(frameInfoSaveCount, self.NO_CLASSIFICATION, dtype=np.int8)
+        self.foreground_classifications = np.full(frameInfoSaveCount, self.NO_CLASSIFICATION, dtype=np.int8)
+        self.frame_states = np.full(frameInfoSaveCount, self.NO_CLASSIFICATION, dtype=np.int8)
+        self.frame_info_start = 0
+        self.frame_info_count = 0
+        # Number of stored frames in each state, indexed by classification code; frames without one are counted last.
+        self.state_counts = [0] * (len(self.CLASSIFICATIONS) + 1)
+
+    # Returns the stored part of a ring buffer, oldest first. It is a view unless the stored part wraps around.
+    def chronological(self, array, start, count):
+        end = start + count
+        if end <= len(array):
+            return array[start:end]
+        return np.concatenate((array[start:], array[:end - len(array)]))
+
+    # Returns the stored part of a ring buffer in any order, which is the whole buffer once it is full.
+    def stored_values(self, array, start, count):
+        if count == len(array):
+            return array
+        return self.chronological(array, start, count)
 
     # Averages the size of the bounding box array.    
     def average_dimensions(self):
-        width = 0
-        height = 0
+        width = int(self.stored_values(self.widths, self.bounding_box_start, self.bounding_box_count).sum())
+        height = int(self.stored_values(self.heights, self.bounding_box_start, self.bounding_box_count).sum())
 
-        for bounding_box in self.bounding_boxes:
-            width += bounding_box.get_width()
-            height += bounding_box.get_height()
-        
-        width = width//len(self.bounding_boxes)
-        height = height//len(self.bounding_boxes)
+        width = width//self.bounding_box_count
+        height = height//self.bounding_box_count
 
         return width, height
     
     # Checks to see if the bounding box has increased recently.
     def check_continuous_decrease(self):
+        areas = self.chronological(self.areas, self.bounding_box_start, self.bounding_box_count)
+        if len(areas) == 0:
+            return True
 
-        previous_area = 640 * 480
-        continuous_decrease = True
-        
-        for bounding_box in self.bounding_boxes:
-            area = bounding_box.get_area()
-
-            if area > previous_area:
-                continuous_decrease = False
-
-            previous_area = area
-
-        return continuous_decrease
+        return bool(areas[0] <= 640 * 480) and not (areas[1:] > areas[:-1]).any()
 
     def average_area(self):
         width, height = self.average_dimensions()
         return width * height
+
+    # The stored bounding boxes as a record array of BOUNDING_BOX_DTYPE, oldest first.
+    def bounding_box_records(self):
+        start, count = self.bounding_box_start, self.bounding_box_count
+        return boundingBoxRecords(*(self.chronological(array, start, count)
+                                    for array in [self.x1, self.x2, self.y1, self.y2, self.widths, self.heights]))
     
+    # Adds a bounding box, replacing the oldest one when the history is full.
     def add_bounding_box(self, boundingBox):
-        self.bounding_boxes = np.append(self.bounding_boxes, boundingBox)
+        if self.bounding_box_full():
+            self.forget_bounding_box(1)
+
+        self.bounding_box_count += 1
+        self.update_bounding_box(boundingBox)
+
+    # Stores the bounding box again as the newest one, after its dimensions were changed.
+    def update_bounding_box(self, boundingBox):
+        index = (self.bounding_box_start + self.bounding_box_count - 1) % self.bounding_box_save_count
+        self.x1[index], self.x2[index] = boundingBox.get_x_coordinates()
+        self.y1[index], self.y2[index] = boundingBox.get_y_coordinates()
+        self.widths[index] = boundingBox.get_width()
+        self.heights[index] = boundingBox.get_height()
+        self.areas[index] = boundingBox.get_area()
 
     def forget_bounding_box(self, frameCount):
-        self.bounding_boxes = np.delete(self.bounding_boxes, np.arange(frameCount))
+        frame_count = min(frameCount, self.bounding_box_count)
+        self.bounding_box_start = (self.bounding_box_start + frame_count) % self.bounding_box_save_count
+        self.bounding_box_count -= frame_count
 
     def bounding_box_full(self):
-        if len(self.bounding_boxes) == self.bounding_box_save_count:
+        if self.bounding_box_count == self.bounding_box_save_count:
             return True
         else:
             return False
     
+    # Adds the classifications of a frame, replacing the oldest ones when the history is full.
     def add_frame_info(self, frameInfo):
-        self.frame_classifications = np.append(self.frame_classifications, frameInfo)
+        if self.frame_info_full():
+            self.forget_frame_info(1)
+
+        index = (self.frame_info_start + self.frame_info_count) % self.frame_info_save_count
+        edge_code = self.classification_code(frameInfo.edge_classification)
+        foreground_code = self.classification_code(frameInfo.foreground_classification)
+        self.edge_classifications[index] = edge_code
+        self.foreground_classifications[index] = foreground_code
+        self.frame_states[index] = self.frame_state(edge_code, foreground_code)
+        self.state_counts[self.frame_states[index]] += 1
+        self.frame_info_count += 1
+
+    def frame_state(self, edgeCode, foregroundCode):
+        for code in self.STATE_ORDER:
+            if edgeCode == code or foregroundCode == code:
+                return code
+        return self.NO_CLASSIFICATION
+
+    def newest_frame_state(self):
+        return self.frame_states[(self.frame_info_start + self.frame_info_count - 1) % self.frame_info_save_count]
+
+    # Number of stored frames whose state is the classification, kept up to date as frames are added and forgotten.
+    def state_count(self, classification):
+        return self.state_counts[self.classification_code(classification)]
+
+    def classification_code(self, classification):
+        if classification in self.CLASSIFICATIONS:
+            return self.CLASSIFICATIONS.index(classification)
+        return self.NO_CLASSIFICATION
 
     def forget_frame_info(self, frameCount):
-        self.frame_classifications = np.delete(self.frame_classifications, np.arange(frameCount))
+        frame_count = min(frameCount, self.frame_info_count)
+        for index in range(frame_count):
+            self.state_counts[self.frame_states[(self.frame_info_start + index) % self.frame_info_save_count]] -= 1
+        self.frame_info_start = (self.frame_info_start + frame_count) % self.frame_info_save_count
+        self.frame_info_count -= frame_count
     
     def frame_info_full(self):
-        if len(self.frame_classifications) == self.frame_info_save_count:
+        if self.frame_info_count == self.frame_info_save_count:
             return True
         else:
             return False
     
+    # Checks whether more than half of the stored edge and foreground classifications are 'falling'.
     def majority_falling(self):
+        edge_classifications = self.stored_values(self.edge_classifications, self.frame_info_start, self.frame_info_count)
+        foreground_classifications = self.stored_values(self.foreground_classifications, self.frame_info_start, self.frame_info_count)
 
-        fall_classifications = 0
-        total_classifications = 0
+        fall_classifications = np.count_nonzero(edge_classifications == self.FALLING) + np.count_nonzero(foreground_classifications == self.FALLING)
+        total_classifications = 2 * self.frame_info_count
 
-        for frame in self.frame_classifications:
-            if frame.edge_classification == 'falling':
-                fall_classifications += 1
-            if frame.foreground_classification == 'falling':
-                fall_classifications +=1
-        
         if fall_classifications > (total_classifications/2):
             return True
         else:
             return False
     
+"""
+FallEvent is one fall found by a FallEventDetector: the frame and time it was confirmed at, and the frame and time of
+the first falling classification that led to it.
+"""
+class FallEvent:
+
+    __slots__ = ('frame_count', 'timestamp', 'start_frame_count', 'start_timestamp')
+
+    def __init__(self, frameCount, timestamp, startFrameCount, startTimestamp):
+        self.frame_count = frameCount
+        self.timestamp = timestamp
+        self.start_frame_count = startFrameCount
+        self.start_timestamp = startTimestamp
+
+    # Frames from the first falling classification to the confirmation of the fall.
+    def frames_to_detect(self):
+        return self.frame_count - self.start_frame_count
+
+    def __str__(self):
+        return f"Fall detected at frame {self.frame_count} ({self.timestamp:%H:%M:%S.%f}), falling since frame {self.start_frame_count}"
+
+"""
+FallEventDetector makes the fall decision as the classified frames arrive rather than once a video has ended. It keeps
+the FrameInfo of the last windowSize classified frames in a FrameHistory and moves between four states:
+
+    upright     no fall is in progress. A falling frame moves to falling.
+    falling     falling frames are in the window. With confirmFrames of them the fall is confirmed, a FallEvent is
+                raised, the window is emptied and the state is down; once none are left, the state is upright again.
+    down        the person is on the ground. With recoverFrames upright frames in the window, all of them after the
+                fall, the state is recovered and the window is emptied, so the falling frames of the last fall do not
+                count towards the next one.
+    recovered   the person got up. A falling frame moves to falling; once no falling frame is left in the window,
+                the state is upright.
+
+Each update only adds a frame to the FrameHistory and reads its state counts, so it takes the same time whatever
+windowSize is, and a fall is raised at most windowSize - 1 frames after the first of its confirmFrames falling frames.
+"""
+class FallEventDetector:
+
+    UPRIGHT = 'upright'
+    FALLING = 'falling'
+    DOWN = 'down'
+    RECOVERED = 'recovered'
+
+    def __init__(self, windowSize = 10, confirmFrames = 3, recoverFrames = 6):
+        self.window_size = windowSize
+        self.confirm_frames = confirmFrames
+        self.recover_frames = recoverFrames
+        self.frame_history = FrameHistory(boundingBoxSaveCount=1, frameInfoSaveCount=windowSize)
+
+        self.state = self.UPRIGHT
+        self.events = []
+        self.fall_start = None
+
+    # Adds the classifications of a frame and returns the FallEvent it confirms, if any.
+    def update(self, frameInfo, frameCount, timestamp = None):
+        if timestamp is None:
+            timestamp = datetime.now()
+
+        self.frame_history.add_frame_info(frameInfo)
+        falling_frames = self.frame_history.state_count('falling')
+        frame_falling = self.frame_history.newest_frame_state() == FrameHistory.FALLING
+
+        if self.state in (self.UPRIGHT, self.RECOVERED) and frame_falling:
+            self.state = self.FALLING
+            self.fall_start = (frameCount, timestamp)
+
+        if self.state == self.FALLING:
+            if falling_frames >= self.confirm_frames:
+                self.state = self.DOWN
+                event = FallEvent(frameCount, timestamp, *self.fall_start)
+                self.events.append(event)
+                self.frame_history.forget_frame_info(self.frame_history.frame_info_count)
+                return event
+            if falling_frames == 0:
+                self.state = self.UPRIGHT
+
+        elif self.state == self.DOWN:
+            if self.frame_history.state_count('upright') >= self.recover_frames:
+                self.state = self.RECOVERED
+                self.frame_history.forget_frame_info(self.frame_history.frame_info_count)
+
+        elif self.state == self.RECOVERED and falling_frames == 0:
+            self.state = self.UPRIGHT
+
+        return None
+
+# Creates the background model ImageManipulator uses to find the moving foreground.
+def createBackgroundSubtractor():
+    return cv2.createBackgroundSubtractorMOG2(history=200, detectShadows=False)
+
 """
 ImageManipulator referenced and defined in section 2.0 of the SDD, A03_SDD_Team4.docx. 
 
@@ -215,17 +407,32 @@ is addressed in extract_foreground() and extract_edges() of the ImageManipulator
 """
 class ImageManipulator:
 
-    fgbg = cv2.createBackgroundSubtractorMOG2(history=200, detectShadows=False)
-    bounding_box_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(30,30))
-
-    # Initialize default values, makes copy of current frame.
-    def __init__(self, frame):
+    fgbg = createBackgroundSubtractor()
+    # Closing kernel for the bounding box at each motion scale, covering the same part of the frame.
+    bounding_box_kernels = {motion_scale: cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (30 // motion_scale, 30 // motion_scale))
+                            for motion_scale in (1, 2, 4)}
+
+    # Initialize default values, makes copy of current frame. A stream with its own background model passes it as
+    # backgroundSubtractor; otherwise the model shared by the class is used. With roiOnly set, extract_edges() and
+    # extract_foreground() only process the padded region of interest around the bounding box. With a motionScale
+    # of 2 or 4, focus_movement() first looks for the movement on a foreground scaled down by that factor. Each step
+    # is timed by the profiler when one is given.
+    def __init__(self, frame, backgroundSubtractor = None, roiOnly = False, motionScale = 1, profiler = None):
+        if motionScale not in self.bounding_box_kernels:
+            raise ValueError(f"Unsupported motion scale: {motionScale}")
+        self.roi_only = roiOnly
+        self.motion_scale = motionScale
+        self.profiler = profiler if profiler is not None else Profiler.DISABLED
         self.source = frame
         self.detection_frame = self.source.copy()
-        self.gray = self.convert_gray_filtered(self.source)
-        self.foreground = self.fgbg.apply(self.gray, learningRate = 0.02)
+        with self.profiler.stage('gray filter'):
+            self.gray = self.convert_gray_filtered(self.source)
+        self.background_subtractor = backgroundSubtractor if backgroundSubtractor is not None else self.fgbg
+        with self.profiler.stage('mog2'):
+            self.foreground = self.background_subtractor.apply(self.gray, learningRate = 0.02)
         
-        self.bounding_box = self.focus_movement(self.source)
+        with self.profiler.stage('focus movement'):
+            self.bounding_box = self.focus_movement(self.source)
         if self.bounding_box is not None:
             self.movement_detected = True
         else:
@@ -284,11 +491,14 @@ class ImageManipulator:
     # Splices the foreground image and returns it.
     def extract_foreground(self):
         if self.bounding_box is not None and self.bounding_box.get_area() > 1000:
-            y1, y2 = self.bounding_box.get_y_coordinates()
-            x1, x2 = self.bounding_box.get_x_coordinates()
-            foreground = cv2.morphologyEx(self.foreground, cv2.MORPH_CLOSE, self.close_kernel)
-            extracted_foreground = np.copy(foreground[y1:y2, x1:x2])
-            extracted_foreground = cv2.resize(extracted_foreground, dsize = (50,75), interpolation=cv2.INTER_CUBIC)
+            with self.profiler.stage('foreground crop'):
+                region, crop = self.crop_regions()
+                foreground = cv2.morphologyEx(self.foreground[region], cv2.MORPH_CLOSE, self.close_kernel)
+                extracted_foreground = np.copy(foreground[crop])
+                # A box resized by change_dimensions() can fall outside the frame.
+                if extracted_foreground.size == 0:
+                    return None
+                extracted_foreground = cv2.resize(extracted_foreground, dsize = (50,75), interpolation=cv2.INTER_CUBIC)
             return extracted_foreground
         else:
             return None
@@ -296,33 +506,113 @@ class ImageManipulator:
     # Splices the edge image and returns it.
     def extract_edges(self):
         if self.bounding_box is not None and self.bounding_box.get_area() > 1000:
-            y1, y2 = self.bounding_box.get_y_coordinates()
-            x1, x2 = self.bounding_box.get_x_coordinates()
+            region, crop = self.crop_regions()
 
             # Performs Canny edge detection on filtered frame.
-            edges_filtered = cv2.Canny(self.gray, 60, 120)
+            with self.profiler.stage('canny'):
+                if self.roi_only:
+                    edges_filtered = self.region_edges(region, crop)
+                else:
+                    edges_filtered = cv2.Canny(self.gray, 60, 120)
 
-            # Crop off the edges out of the moving area
-            cropped_edges = (self.foreground // 255) * edges_filtered
+            with self.profiler.stage('edge crop'):
+                # Crop off the edges out of the moving area
+                cropped_edges = (self.foreground[region] // 255) * edges_filtered
 
-            extracted_edges = np.copy(cropped_edges[y1:y2, x1:x2])
-            extracted_edges = cv2.resize(extracted_edges, dsize = (50,75), interpolation=cv2.INTER_CUBIC)
+                extracted_edges = np.copy(cropped_edges[crop])
+                # A box resized by change_dimensions() can fall outside the frame.
+                if extracted_edges.size == 0:
+                    return None
+                extracted_edges = cv2.resize(extracted_edges, dsize = (50,75), interpolation=cv2.INTER_CUBIC)
             return extracted_edges
         else:
             return None
 
+    # Returns the region of the frame to process and the bounding box crop within that region. Without roiOnly the
+    # region is the full frame. With it, the region is the crop padded by twice the close kernel, which covers every
+    # pixel the close can reach and leaves Canny's gradients and edge tracing a margin around the crop.
+    def crop_regions(self):
+        y1, y2 = self.bounding_box.get_y_coordinates()
+        x1, x2 = self.bounding_box.get_x_coordinates()
+        if not self.roi_only:
+            return (slice(None), slice(None)), (slice(y1, y2), slice(x1, x2))
+
+        height, width = self.foreground.shape[:2]
+        padding = 2 * max(self.close_kernel.shape)
+
+        # Follows numpy's slicing rules, so the crop is the one the full frame path takes.
+        row_start, row_stop, _ = slice(y1, y2).indices(height)
+        column_start, column_stop, _ = slice(x1, x2).indices(width)
+        row_stop = max(row_start, row_stop)
+        column_stop = max(column_start, column_stop)
+
+        region_row = max(0, row_start - padding)
+        region_column = max(0, column_start - padding)
+        region = (slice(region_row, min(height, row_stop + padding)), slice(region_column, min(width, column_stop + padding)))
+        crop = (slice(row_start - region_row, row_stop - region_row), slice(column_start - region_column, column_stop - region_column))
+        return region, crop
+
+    # Canny edges of the region, equal to the region of the full frame's edges wherever they are used. Two pixels in
+    # from the region's sides inside the frame the gradients are exact, but edge tracing can follow weak edges out of
+    # the region and back. If weak edges reaching the moving area of the crop touch that border without a strong edge
+    # among them, their result depends on pixels outside the region and Canny is run on the full frame instead.
+    def region_edges(self, region, crop):
+        gray = self.gray[region]
+        edges = cv2.Canny(gray, 60, 120)
+
+        height, width = self.gray.shape[:2]
+        border = np.zeros(gray.shape, dtype=bool)
+        if region[0].start > 0:
+            border[:2] = True
+        if region[0].stop < height:
+            border[-2:] = True
+        if region[1].start > 0:
+            border[:, :2] = True
+        if region[1].stop < width:
+            border[:, -2:] = True
+        if not border.any():
+            return edges
+
+        # Canny with equal thresholds marks every weak or strong edge candidate, or only the strong ones.
+        candidates = cv2.Canny(gray, 60, 60)
+        candidates[border] = 0
+        strong = cv2.Canny(gray, 120, 120)
+        _, labels = cv2.connectedComponents(candidates, connectivity=8)
+
+        next_to_border = cv2.dilate(border.astype(np.uint8), np.ones((3, 3), np.uint8)).astype(bool) & ~border
+        moving = np.zeros(gray.shape, dtype=bool)
+        moving[crop] = self.foreground[region][crop] > 0
+
+        unresolved = np.intersect1d(labels[next_to_border & (candidates > 0)], labels[moving & (candidates > 0)])
+        unresolved = np.setdiff1d(unresolved, labels[(strong > 0) & ~border])
+        if len(unresolved) > 0:
+            return cv2.Canny(self.gray, 60, 120)[region]
+        return edges
+
     # Creates the bounding boxes and finds the best one.
     def focus_movement(self, source):
 
         bounding_box = None
 
-        foreground = cv2.morphologyEx(self.foreground, cv2.MORPH_CLOSE, self.bounding_box_kernel)
+        region = self.motion_region()
+        foreground = cv2.morphologyEx(self.foreground[region], cv2.MORPH_CLOSE, self.bounding_box_kernels[1])
         bounding_ret, bounding_thresh = cv2.threshold(foreground, 91, 255, cv2.THRESH_BINARY)
         contours = cv2.findContours(bounding_thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
 
         if len(contours) != 0:
             contour = max(contours, key = cv2.contourArea)
             x_pos, y_pos, width, height = cv2.boundingRect(contour)
+
+            # The movement may continue past a side of the region, in which case the whole frame is searched.
+            if not self.inside_region(region, x_pos, y_pos, width, height):
+                region = (slice(None), slice(None))
+                foreground = cv2.morphologyEx(self.foreground, cv2.MORPH_CLOSE, self.bounding_box_kernels[1])
+                bounding_ret, bounding_thresh = cv2.threshold(foreground, 91, 255, cv2.THRESH_BINARY)
+                contours = cv2.findContours(bounding_thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+                x_pos, y_pos, width, height = cv2.boundingRect(max(contours, key = cv2.contourArea))
+
+            x_pos += region[1].start or 0
+            y_pos += region[0].start or 0
             bounding_rect = np.array([[x_pos, y_pos, x_pos + width, y_pos + height]])
             optimal_pick = non_max_suppression(bounding_rect, probs=None, overlapThresh=0.65)
             for (x1, y1, x2, y2) in optimal_pick:
@@ -330,6 +620,47 @@ class ImageManipulator:
 
         return bounding_box
 
+    # The region of the frame focus_movement() closes at full resolution. At a motion scale of 1 that is the whole
+    # frame. Otherwise the foreground is scaled down and closed with a kernel scaled to match, and the region is the
+    # largest movement found there, padded by twice the full resolution kernel so that closing the region gives
+    # the same result there as closing the whole frame. When a second movement is close to the largest in size,
+    # the scaled down frame cannot tell which is larger and the whole frame is used.
+    def motion_region(self):
+        if self.motion_scale == 1:
+            return (slice(None), slice(None))
+
+        height, width = self.foreground.shape[:2]
+        scaled_foreground = cv2.resize(self.foreground, (width // self.motion_scale, height // self.motion_scale), interpolation=cv2.INTER_AREA)
+        scaled_foreground = cv2.morphologyEx(scaled_foreground, cv2.MORPH_CLOSE, self.bounding_box_kernels[self.motion_scale])
+        bounding_ret, bounding_thresh = cv2.threshold(scaled_foreground, 91, 255, cv2.THRESH_BINARY)
+        contours = cv2.findContours(bounding_thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+        if len(contours) == 0:
+            return (slice(None), slice(None))
+
+        areas = sorted((cv2.contourArea(contour) for contour in contours), reverse=True)
+        if len(areas) > 1 and areas[1] >= areas[0] / 2:
+            return (slice(None), slice(None))
+
+        x_pos, y_pos, scaled_width, scaled_height = cv2.boundingRect(max(contours, key = cv2.contourArea))
+        padding = 2 * self.bounding_box_kernels[1].shape[0] + self.motion_scale
+        return (slice(max(0, y_pos * self.motion_scale - padding), min(height, (y_pos + scaled_height) * self.motion_scale + padding)),
+                slice(max(0, x_pos * self.motion_scale - padding), min(width, (x_pos + scaled_width) * self.motion_scale + padding)))
+
+    # Whether a rectangle found in the region stays a kernel's width from the region's sides that are inside the
+    # frame. Closer to those sides, closing the region can differ from closing the whole frame.
+    def inside_region(self, region, x_pos, y_pos, width, height):
+        frame_height, frame_width = self.foreground.shape[:2]
+        row_start, row_stop, _ = region[0].indices(frame_height)
+        column_start, column_stop, _ = region[1].indices(frame_width)
+        margin = self.bounding_box_kernels[1].shape[0]
+
+        clear_top = row_start == 0 or y_pos >= margin
+        clear_bottom = row_stop == frame_height or y_pos + height <= row_stop - row_start - margin
+        clear_left = column_start == 0 or x_pos >= margin
+        clear_right = column_stop == frame_width or x_pos + width <= column_stop - column_start - margin
+        return clear_top and clear_bottom and clear_left and clear_right
+
     # Draws the best bounding box to the video feed.
     def draw_bounding_box(self, source, minArea=500, bufferSpace=40):
 
@@ -370,12 +701,525 @@ def showImage(source):
 
     return cv2.destroyAllWindows()
 
+"""
+FrameResult is the outcome of processing one frame: its number, the bounding box of the movement found in it, if any,
+and the edge and foreground classifications when the frame was classified. While a frame is displayed the result
+also holds its ImageManipulator and whether the bounding box is drawn.
+"""
+class FrameResult:
+
+    def __init__(self, frameCount, boundingBox = None, edgeClassification = None, foregroundClassification = None,
+                 imageManipulator = None, showBox = False):
+        self.frame_count = frameCount
+        self.bounding_box = boundingBox
+        self.edge_classification = edgeClassification
+        self.foreground_classification = foregroundClassification
+        self.image_manipulator = imageManipulator
+        self.show_box = showBox
+
+        # Set when a MotionGate skipped the frame without processing it.
+        self.skipped = False
+        # The FallEvent the classifications of this frame confirmed, if any.
+        self.fall_event = None
+
+        # The edge and foreground crops, set when the frame was cropped for classification.
+        self.cropped = False
+        self.edge_crop = None
+        self.foreground_crop = None
+
+    def classified(self):
+        return self.edge_classification is not None
+
+    def falling(self):
+        return (self.edge_classification == 'falling') or (self.foreground_classification == 'falling')
+
+    # The state display() prints for a classified frame, checking the classifications in the same order.
+    def state(self):
+        for classification, state in [('falling', "fall"), ('upright', "upright"), ('sitting', "sitting"),
+                                      ('lying', "lying"), ('unrecognized', "unrecognized object")]:
+            if (self.edge_classification == classification) or (self.foreground_classification == classification):
+                return state
+        return None
+
+    # Displays the frame, when it is displayed at all.
+    def display_cv(self):
+        if self.image_manipulator is not None:
+            self.image_manipulator.display_cv(showBox=self.show_box)
+
+"""
+MotionGate decides, before the bilateral filter, background subtraction and closing of an ImageManipulator, whether
+a frame is worth processing. Each frame is shrunk to a small grayscale thumbnail and compared with the thumbnail of
+the previous frame; its change is the number of thumbnail pixels that differ by more than pixelThreshold. A frame
+wakes the gate when its change is above the wake threshold, which adapts to the camera's noise: wakeFactor times
+the running average change of the static frames, those skipped and those processed without movement, and never
+below minimumChange. The gate stays awake while the
+processed frames show movement and for holdFrames after, and lets a frame through at least every refreshInterval
+frames so that the background model keeps learning the scene. The number of skipped frames is kept in skipped.
+"""
+class MotionGate:
+
+    def __init__(self, thumbnailWidth = 160, pixelThreshold = 4, minimumChange = 1, wakeFactor = 2.0, noiseDecay = 0.05,
+                 holdFrames = 15, refreshInterval = 30):
+        self.thumbnail_width = thumbnailWidth
+        self.pixel_threshold = pixelThreshold
+        self.minimum_change = minimumChange
+        self.wake_factor = wakeFactor
+        self.noise_decay = noiseDecay
+        self.hold_frames = holdFrames
+        self.refresh_interval = refreshInterval
+
+        self.previous_thumbnail = None
+        self.noise = 0.0
+        self.change = 0
+        self.hold = 0
+        self.since_processed = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def thumbnail(self, frame):
+        height, width = frame.shape[:2]
+        thumbnail_height = max(1, round(height * self.thumbnail_width / width))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (self.thumbnail_width, thumbnail_height), interpolation=cv2.INTER_AREA)
+
+    def wake_threshold(self):
+        return max(self.minimum_change, self.wake_factor * self.noise)
+
+    # Returns whether the frame should be processed, counting it as skipped when it should not.
+    def wake(self, frame):
+        thumbnail = self.thumbnail(frame)
+        self.frames += 1
+
+        # The first frame, or the first after the frame size changed, has nothing to compare with and is always processed.
+        first_frame = self.previous_thumbnail is None or self.previous_thumbnail.shape != thumbnail.shape
+        if first_frame:
+            self.change = 0
+        else:
+            self.change = np.count_nonzero(cv2.absdiff(thumbnail, self.previous_thumbnail) > self.pixel_threshold)
+        self.previous_thumbnail = thumbnail
+
+        awake = (first_frame or (self.change > self.wake_threshold()) or (self.hold > 0)
+                 or (self.since_processed + 1 >= self.refresh_interval))
+        if awake:
+            self.since_processed = 0
+            self.hold = max(0, self.hold - 1)
+        else:
+            self.learn_noise()
+            self.since_processed += 1
+            self.skipped += 1
+        return awake
+
+    # Keeps the gate awake for holdFrames after a processed frame in which movement was detected. A processed frame
+    # without movement is static, so its change is noise.
+    def record(self, movementDetected):
+        if movementDetected:
+            self.hold = self.hold_frames
+        else:
+            self.learn_noise()
+
+    def learn_noise(self):
+        self.noise += self.noise_decay * (self.change - self.noise)
+
+"""
+FrameProcessor holds the per frame steps of the display function: movement detection, the bounding box history,
+obstruction handling, crop extraction, classification and template saving. Both the serial display loop and the
+FramePipeline processing stage call process(), so the two paths detect falls the same way.
+"""
+class FrameProcessor:
+
+    BOUNDING_BOX_COUNT = 5
+    FRAME_INFO_COUNT = 5
+
+    # printClassifications is False in headless mode, where the classifications are only returned in the FrameResults.
+    # With a MotionGate, frames the gate skips are not processed at all. The steps are timed by the profiler when one
+    # is given.
+    def __init__(self, foregroundClassifier, edgeClassifier, saveTemplate = False, checkTemplate = False, sessionName = None, videoPath = None,
+                 printClassifications = True, backgroundSubtractor = None, roiOnly = False, motionScale = 1, motionGate = None,
+                 profiler = None):
+        self.foreground_classifier = foregroundClassifier
+        self.edge_classifier = edgeClassifier
+        self.save_template = saveTemplate
+        self.check_template = checkTemplate
+        self.session_name = sessionName
+        self.video_path = videoPath
+        self.print_classifications = printClassifications
+        self.background_subtractor = backgroundSubtractor
+        self.roi_only = roiOnly
+        self.motion_scale = motionScale
+        self.motion_gate = motionGate
+        self.profiler = profiler if profiler is not None else Profiler.DISABLED
+
+        self.frame_history = FrameHistory(boundingBoxSaveCount=self.BOUNDING_BOX_COUNT, frameInfoSaveCount=self.FRAME_INFO_COUNT)
+        self.fall_counter = 0
+        self.fall_event_detector = FallEventDetector()
+
+    # Processes one frame and returns its FrameResult.
+    def process(self, frame, frameCount):
+        result = self.extract(frame, frameCount)
+
+        if result.cropped and self.check_template:
+            with self.profiler.stage('edge classify'):
+                edge_classification = self.edge_classifier.classify(result.edge_crop)
+            with self.profiler.stage('foreground classify'):
+                foreground_classification = self.foreground_classifier.classify(result.foreground_crop)
+            self.record_classifications(result, edge_classification, foreground_classification)
+        return result
+
+    # Runs every step of process() except classification, leaving the crops in the FrameResult so that crops
+    # of several frames can be classified together.
+    def extract(self, frame, frameCount):
+        if self.motion_gate is not None:
+            with self.profiler.stage('motion gate'):
+                awake = self.motion_gate.wake(frame)
+            if not awake:
+                result = FrameResult(frameCount)
+                result.skipped = True
+                return result
+
+        current_frame = ImageManipulator(frame, self.background_subtractor, self.roi_only, self.motion_scale, self.profiler)
+        result = FrameResult(frameCount, imageManipulator=current_frame)
+        if self.motion_gate is not None:
+            self.motion_gate.record(current_frame.check_movement_detected())
+
+        if not current_frame.check_movement_detected():
+            # Nothing is displayed for a frame without movement.
+            result.image_manipulator = None
+            return result
+
+        # Current frame bounding box gets added to frame history
+        if self.frame_history.bounding_box_full():
+            self.frame_history.forget_bounding_box(1)
+        self.frame_history.add_bounding_box(current_frame.get_bounding_box())
+        result.bounding_box = current_frame.get_bounding_box()
+
+        if self.frame_history.check_continuous_decrease():
+            return result
+
+        # Check for potential obstruction
+        average_area = self.frame_history.average_area()
+        current_bounding_box = current_frame.get_bounding_box()
+
+        if current_bounding_box.get_area() < average_area:
+
+            width, height = self.frame_history.average_dimensions()
+            current_bounding_box.change_dimensions(width, height)
+            current_frame.set_bounding_box(current_bounding_box)
+            self.frame_history.update_bounding_box(current_bounding_box)
+
+        result.show_box = True
+        result.cropped = True
+        result.edge_crop = current_frame.extract_edges()
+        result.foreground_crop = current_frame.extract_foreground()
+
+        if self.save_template:
+
+            template_name = self.session_name if self.video_path is None else self.video_path[15:-4]
+            save_path_foreground_template = f"./templates/cropped_templates/foreground/{template_name}_{str(frameCount)}.png"
+            save_path_edge_template = f"./templates/cropped_templates/edge/{template_name}_{str(frameCount)}.png"
+
+            cv2.imwrite(save_path_foreground_template, result.foreground_crop)
+            cv2.imwrite(save_path_edge_template, result.edge_crop)
+
+        return result
+
+    # Stores the classifications of a cropped frame, counts it towards a fall and passes it to the FallEventDetector.
+    def record_classifications(self, result, edgeClassification, foregroundClassification):
+        result.edge_classification = edgeClassification
+        result.foreground_classification = foregroundClassification
+
+        if result.falling():
+            self.fall_counter = self.fall_counter + 1
+        result.fall_event = self.fall_event_detector.update(FrameInfo(edgeClassification, foregroundClassification), result.frame_count)
+
+        # Displays to the console which classification, if any, is detected each frame.
+        if self.print_classifications and result.state() is not None:
+            print(result.state())
+        if self.print_classifications and result.fall_event is not None:
+            print(result.fall_event)
+
+    # Whether more than 3 frames were classified as falling over the whole video.
+    def fall_detected(self):
+        return self.fall_counter > 3
+
+    # The FallEvents raised so far, as the frames were classified.
+    def fall_events(self):
+        return self.fall_event_detector.events
+
+    # Applies a key pressed in the display window. Returns False when the user asked to quit.
+    def handle_key(self, key):
+
+        # Press Q on keyboard to exit
+        if key == ord('q'):
+            return False
+
+        # save frame as template
+        elif key == ord('1'):
+            self.save_template = not self.save_template
+            print(f'saveTemplate: {self.save_template}')
+
+        # clasify frame with templates
+        elif key == ord('2'):
+            self.check_template = not self.check_template
+            print(f'checkTemplate: {self.check_template}')
+
+        return True
+
+"""
+FrameQueue is a bounded queue.Queue between two FramePipeline stages with a policy for a full queue: 'block' waits
+for space, 'drop-oldest' discards the oldest queued frame to make room and 'drop-newest' discards the frame being
+added. The number of discarded frames is kept in dropped. The END marker that closes a stage is never discarded.
+"""
+class FrameQueue(Queue):
+
+    END = object()
+    drop_policies = ('block', 'drop-oldest', 'drop-newest')
+
+    def __init__(self, maxsize = 4, dropPolicy = 'drop-oldest'):
+        if dropPolicy not in self.drop_policies:
+            raise ValueError(f"Unknown drop policy: {dropPolicy}")
+        super().__init__(maxsize)
+        self.drop_policy = dropPolicy
+        self.dropped = 0
+
+    def put(self, item, block = True, timeout = None):
+        if self.drop_policy == 'block':
+            return super().put(item, block, timeout)
+
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                self.dropped += 1
+                if self.drop_policy == 'drop-newest' and item is not self.END:
+                    return
+                self._get()
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+"""
+StageCounters records how many frames a FramePipeline stage handled and how long it spent on them, giving the
+stage's average latency and its throughput since it started.
+"""
+class StageCounters:
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy_seconds = 0
+        self.started = timer()
+        self.stopped = None
+
+    def record(self, seconds):
+        self.frames += 1
+        self.busy_seconds += seconds
+
+    def stop(self):
+        self.stopped = timer()
+
+    def latency_ms(self):
+        return 1000 * self.busy_seconds / self.frames if self.frames > 0 else 0
+
+    def throughput(self):
+        seconds = (self.stopped if self.stopped is not None else timer()) - self.started
+        return self.frames / seconds if seconds > 0 else 0
+
+    def __str__(self):
+        return f"{self.name:<10}{self.frames:>8} frames{self.latency_ms():>10.2f} ms/frame{self.throughput():>10.1f} frames/s"
+
+"""
+FramePipeline runs the display function as three stages so that a slow classification does not stall the camera:
+a capture thread reads frames, a processing thread runs them through a FrameProcessor, and the calling thread,
+which owns the OpenCV windows, presents the results and reads the keyboard. The stages are linked by FrameQueues.
+The processing stage handles frames in capture order on a single thread, because the background model learns
+from every frame; with the 'block' capture policy no frame is skipped and a video gives the same result as the
+serial display loop. Each stage's StageCounters are kept in stage_counters.
+"""
+class FramePipeline:
+
+    def __init__(self, frameProcessor, capture, queueSize = 4, captureDropPolicy = 'drop-oldest', displayDropPolicy = 'drop-oldest'):
+        self.frame_processor = frameProcessor
+        self.capture = capture
+        self.capture_queue = FrameQueue(queueSize, captureDropPolicy)
+        self.display_queue = FrameQueue(queueSize, displayDropPolicy)
+
+        self.stage_counters = {'capture': StageCounters('capture'),
+                               'process': StageCounters('process'),
+                               'display': StageCounters('display')}
+        self.stopping = threading.Event()
+        self.errors = []
+
+    # Runs until the capture ends or the user quits, and returns whether a fall was detected.
+    def run(self):
+        threads = [threading.Thread(target=self.run_stage, args=(self.capture_frames, self.capture_queue), daemon=True),
+                   threading.Thread(target=self.run_stage, args=(self.process_frames, self.display_queue), daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            self.present_frames()
+        finally:
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+            for counters in self.stage_counters.values():
+                counters.stop()
+
+        if len(self.errors) > 0:
+            raise self.errors[0]
+        return self.frame_processor.fall_detected()
+
+    # Runs a stage on its own thread and always closes its output queue, so that the next stage finishes too.
+    def run_stage(self, stage, outputQueue):
+        try:
+            stage()
+        except Exception as error:
+            self.errors.append(error)
+        finally:
+            self.put(outputQueue, FrameQueue.END)
+
+    # Adds an item to a queue, giving up once the pipeline is stopping.
+    def put(self, queue, item):
+        while not self.stopping.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    # Takes the next item from a queue, returning END once the pipeline is stopping.
+    def get(self, queue):
+        while not self.stopping.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                pass
+        return FrameQueue.END
+
+    def capture_frames(self):
+        counters = self.stage_counters['capture']
+        frame_count = 0
+
+        while self.capture.isOpened() and not self.stopping.is_set():
+            start = timer()
+            ret, frame = self.capture.read()
+            if not ret:
+                break
+
+            seconds = timer() - start
+            counters.record(seconds)
+            self.frame_processor.profiler.record('read', seconds)
+            if not self.put(self.capture_queue, (frame_count, frame)):
+                break
+            frame_count += 1
+
+    def process_frames(self):
+        counters = self.stage_counters['process']
+
+        while True:
+            item = self.get(self.capture_queue)
+            if item is FrameQueue.END:
+                break
+
+            start = timer()
+            frame_count, frame = item
+            result = self.frame_processor.process(frame, frame_count)
+            counters.record(timer() - start)
+
+            if not self.put(self.display_queue, result):
+                break
+
+    def present_frames(self):
+        counters = self.stage_counters['display']
+
+        while True:
+            try:
+                item = self.display_queue.get(timeout=0.025)
+            except Empty:
+                # Keeps the windows responsive while waiting for the next frame.
+                item = None
+            if item is FrameQueue.END:
+                break
+
+            start = timer()
+            if item is not None:
+                item.display_cv()
+                seconds = timer() - start
+                counters.record(seconds)
+                self.frame_processor.profiler.record('display', seconds)
+
+            # controls
+            key = cv2.waitKey(1) & 0xFF
+            if not self.frame_processor.handle_key(key):
+                break
+
+    def print_counters(self):
+        for counters in self.stage_counters.values():
+            print(counters)
+        print(f"dropped   {self.capture_queue.dropped:>8} captured frames{self.display_queue.dropped:>8} displayed frames")
+        if self.frame_processor.motion_gate is not None:
+            print(f"skipped   {self.frame_processor.motion_gate.skipped:>8} static frames")
+
+# Processes a video file, or the camera when videoPath is None, without any windows or waiting between frames, and
+# yields a FrameResult for every frame read. Every frame is classified. The frame rate is printed at the end
+# unless printFrameRate is False. Reading and every processing step are timed by the profiler when one is given.
+def processHeadless(foregroundClassifier, edgeClassifier, videoPath = None, saveTemplate = False, sessionName = None,
+                    backgroundSubtractor = None, printFrameRate = True, roiOnly = False, motionScale = 1, motionGate = None,
+                    profiler = None):
+    if profiler is None:
+        profiler = Profiler.DISABLED
+    frame_processor = FrameProcessor(foregroundClassifier, edgeClassifier, saveTemplate=saveTemplate, checkTemplate=True,
+                                     sessionName=sessionName, videoPath=videoPath, printClassifications=False,
+                                     backgroundSubtractor=backgroundSubtractor, roiOnly=roiOnly, motionScale=motionScale,
+                                     motionGate=motionGate, profiler=profiler)
+    counters = StageCounters('headless')
+
+    if videoPath is not None:
+        cap = cv2.VideoCapture(videoPath)
+    else:
+        cap = cv2.VideoCapture(cv2.CAP_DSHOW)
+
+    if not cap.isOpened():
+        print("Error opening video stream or file")
+
+    frame_count = 0
+    try:
+        while cap.isOpened():
+            start = timer()
+            with profiler.stage('read'):
+                ret, frame = cap.read()
+            if not ret:
+                break
+
+            result = frame_processor.process(frame, frame_count)
+            # Results are kept by the caller, so they do not hold on to the frame images.
+            result.image_manipulator = None
+            counters.record(timer() - start)
+
+            yield result
+            frame_count += 1
+    finally:
+        cap.release()
+        counters.stop()
+        if printFrameRate:
+            print(f"Processed {counters.frames} frames in {counters.busy_seconds:.2f} s "
+                  f"({counters.frames / counters.busy_seconds if counters.busy_seconds > 0 else 0:.1f} frames/s).")
+            if motionGate is not None:
+                print(f"The motion gate skipped {motionGate.skipped} of {motionGate.frames} frames.")
+
+# Applies the rule display() uses to decide whether a fall happened to a stream of FrameResults.
+def fallDetected(results):
+    fall_counter = 0
+    for result in results:
+        if result.falling():
+            fall_counter += 1
+    return fall_counter > 3
+
 """
 The Functional Requirement:
 
 FR.2 The system must alert the user when an object classified as a “human” falls in an indoor environment.
 
-is addressed under the checkTemplates if branch in the display function.
+is addressed under the checkTemplates if branch in FrameProcessor.process(), which the display function uses.
 The code in this branch also represents the Alert component referenced in section 3.2 of the SDD, A03_SDD_Team4.docx. 
 
 
@@ -384,14 +1228,33 @@ The Functional Requirement:
 FR.6 The system must access the live video feed.
 
 is addressed in the display function()
-"""
-def display(foregroundClassifier, edgeClassifier, videoPath = None, saveTemplate = False, checkTemplate = False, sessionName = None):
 
-    BOUNDING_BOX_COUNT = 5
-    FRAME_INFO_COUNT = 5
-    frame_history = FrameHistory(boundingBoxSaveCount=BOUNDING_BOX_COUNT, frameInfoSaveCount=FRAME_INFO_COUNT)
-    fall_detected = False
-    fall_counter = 0
+With headless set, the frames are processed by processHeadless() without any windows and always classified.
+With pipeline set, the frames are captured, processed and displayed on separate threads by a FramePipeline. A
+video file is then read with the 'block' policy so every frame is processed, while a camera drops its oldest
+frames when processing falls behind, unless captureDropPolicy says otherwise. With roiOnly set, the crops are
+extracted by processing only the region of interest around the bounding box. A motionScale of 2 or 4 first looks
+for the movement on a scaled down foreground. With motionGate set, a MotionGate skips the frames of a static scene.
+With profilePath set, every stage is timed and its percentiles are printed at the end and written to profilePath.
+"""
+def display(foregroundClassifier, edgeClassifier, videoPath = None, saveTemplate = False, checkTemplate = False, sessionName = None,
+            pipeline = False, queueSize = 4, captureDropPolicy = None, displayDropPolicy = 'drop-oldest', headless = False,
+            roiOnly = False, motionScale = 1, motionGate = False, profilePath = None):
+
+    profiler = Profiler.Profiler(videoPath or 'camera') if profilePath is not None else Profiler.DISABLED
+
+    if headless:
+        fall_detected = fallDetected(processHeadless(foregroundClassifier, edgeClassifier, videoPath=videoPath,
+                                                     saveTemplate=saveTemplate, sessionName=sessionName, roiOnly=roiOnly,
+                                                     motionScale=motionScale, motionGate=MotionGate() if motionGate else None,
+                                                     profiler=profiler))
+        reportProfile(profiler, profilePath)
+        return fall_detected
+
+    frame_processor = FrameProcessor(foregroundClassifier, edgeClassifier, saveTemplate=saveTemplate,
+                                     checkTemplate=checkTemplate, sessionName=sessionName, videoPath=videoPath, roiOnly=roiOnly,
+                                     motionScale=motionScale, motionGate=MotionGate() if motionGate else None,
+                                     profiler=profiler)
     frame_count = 0
 
     if saveTemplate:
@@ -413,86 +1276,40 @@ def display(foregroundClassifier, edgeClassifier, videoPath = None, saveTemplate
     2           Toggles classification 
     """)
 
+    if pipeline:
+        if captureDropPolicy is None:
+            captureDropPolicy = 'block' if videoPath is not None else 'drop-oldest'
+
+        frame_pipeline = FramePipeline(frame_processor, cap, queueSize=queueSize,
+                                       captureDropPolicy=captureDropPolicy, displayDropPolicy=displayDropPolicy)
+        try:
+            frame_pipeline.run()
+        finally:
+            cap.release()
+            cv2.destroyAllWindows()
+        frame_pipeline.print_counters()
+        reportProfile(profiler, profilePath)
+        return frame_processor.fall_detected()
+
     # Read the video
     while(cap.isOpened()):
 
         # Capture frame-by-frame
-        ret, frame = cap.read()
+        with profiler.stage('read'):
+            ret, frame = cap.read()
 
         if ret == True:
 
-            current_frame = ImageManipulator(frame)
-
-            if current_frame.check_movement_detected():
-
-                # Current frame bounding box gets added to frame history
-                if frame_history.bounding_box_full():
-                    frame_history.forget_bounding_box(1)
-                frame_history.add_bounding_box(current_frame.get_bounding_box())
-
-                if not frame_history.check_continuous_decrease():
-                    # Check for potential obstruction
-                    average_area = frame_history.average_area()
-                    current_bounding_box = current_frame.get_bounding_box()
-
-                    if current_bounding_box.get_area() < average_area:
-                        
-                        width, height = frame_history.average_dimensions()
-                        current_bounding_box.change_dimensions(width, height)
-                        current_frame.set_bounding_box(current_bounding_box)
-                    
-                    extracted_edges = current_frame.extract_edges()
-                    extracted_foreground = current_frame.extract_foreground()
-
-                    # Displays to the console which classification, if any, is detected each frame.
-                    if checkTemplate:
-
-                        edge_classification = edgeClassifier.classify(extracted_edges)
-                        foreground_classification = foregroundClassifier.classify(extracted_foreground)
-                        
-                        if (edge_classification == 'falling') or (foreground_classification == 'falling'):
-                            print("fall")
-                            fall_counter = fall_counter + 1
-                        elif (edge_classification == 'upright') or (foreground_classification == 'upright'):
-                            print("upright")
-                        elif (edge_classification == 'sitting') or (foreground_classification == 'sitting'):
-                            print("sitting")
-                        elif (edge_classification == 'lying') or (foreground_classification == 'lying'):
-                            print("lying")
-                        elif (edge_classification == 'unrecognized') or (foreground_classification == 'unrecognized'):
-                            print("unrecognized object")
-                        
-                    if saveTemplate:
-
-                        save_path_foreground_template = f"./templates/cropped_templates/foreground/{sessionName if videoPath is None else videoPath[15:-4]}_{str(frame_count)}.png"
-                        save_path_edge_template = f"./templates/cropped_templates/edge/{sessionName if videoPath is None else videoPath[15:-4]}_{str(frame_count)}.png"
-                        
-                        cv2.imwrite(save_path_foreground_template, extracted_foreground)
-                        cv2.imwrite(save_path_edge_template, extracted_edges)
-                    
-                    # Display the resulting frame
-                    current_frame.display_cv()
-
-                else:
-                    current_frame.display_cv(showBox=False)
+            # Display the resulting frame
+            result = frame_processor.process(frame, frame_count)
+            with profiler.stage('display'):
+                result.display_cv()
 
             # controls
             key = cv2.waitKey(25) & 0xFF
-
-            # Press Q on keyboard to exit
-            if key == ord('q'):
+            if not frame_processor.handle_key(key):
                 break
 
-            # save frame as template
-            elif key == ord('1'):
-                saveTemplate = not saveTemplate
-                print(f'saveTemplate: {saveTemplate}')
-
-            # clasify frame with templates
-            elif key == ord('2'):
-                checkTemplate = not checkTemplate
-                print(f'checkTemplate: {checkTemplate}')
-
             frame_count += 1
 
         # Break the loop
@@ -503,9 +1320,16 @@ def display(foregroundClassifier, edgeClassifier, videoPath = None, saveTemplate
     cap.release()
 
     cv2.destroyAllWindows()
-    if (fall_counter > 3):
-        fall_detected = True
-    return fall_detected
+    reportProfile(profiler, profilePath)
+    return frame_processor.fall_detected()
+
+# Prints the stage percentiles of an enabled profiler and writes them to profilePath
+def reportProfile(profiler, profilePath):
+    if not profiler.enabled:
+        return
+    rows = profiler.summary()
+    Profiler.printSummary(rows)
+    Profiler.exportSummary(rows, profilePath)
 
 def imagePathToByteString(path):
     with open(path, 'rb') as f:
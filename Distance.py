@@ -0,0 +1,385 @@
+"""
+Distance.py holds the distance kernels KNeighborsClassifier measures templates with, such as exact Euclidean distance
+on uint8 crops and Hamming distance on bit-packed binary maps.
+
+
+
+Copyright (c) 2020 Fall Detection System, All rights reserved.
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1.	Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2.	Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer
+    in the documentation and/or other materials provided with the distribution.
+
+3.	Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import threading
+import numpy as np
+
+# Distance metrics distanceKernel() can build a kernel for.
+METRICS = ('l2', 'l2-expanded', 'hamming')
+
+# Upper bound on the number of values a kernel's workspace holds, as KNeighborsClassifier.batch_element_limit.
+WORKSPACE_ELEMENTS = 2 ** 21
+
+# Pixels above this value are set in a binary map.
+BINARY_THRESHOLD = 127
+
+# Height and width of an edge or foreground crop.
+TEMPLATE_SHAPE = (75, 50)
+
+# Height and width of the thumbnails a coarse-to-fine search compares first.
+THUMBNAIL_SHAPE = (18, 12)
+
+# Number of set bits in every 16 bit value, for numpy versions without np.bitwise_count().
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(2 ** 16)], dtype=np.uint8)
+
+"""
+Workspace keeps named scratch buffers per thread for a kernel, so that measuring distances does not allocate a
+temporary the size of the template matrix on every call and a classifier shared by several threads stays read only.
+"""
+class Workspace(threading.local):
+
+    def __init__(self):
+        self.buffers = {}
+
+    # A (rowCount, width) buffer of the given dtype. Its contents are left over from the last use. A buffer is only
+    # replaced when a larger one is needed, so calls with the same or fewer rows reuse it.
+    def buffer(self, rowCount, width, dtype, name = 'chunk'):
+        key = (name, np.dtype(dtype))
+        buffer = self.buffers.get(key)
+        if buffer is None or buffer.shape[0] < rowCount or buffer.shape[1] != width:
+            buffer = np.empty((rowCount, width), dtype=dtype)
+            self.buffers[key] = buffer
+        return buffer[:rowCount]
+
+"""
+RowBuffer keeps a matrix, or a vector, that grows by whole rows and shrinks by dropping rows, as a view of the start of
+a larger buffer. Added rows are written into spare capacity, which doubles when it runs out, and dropped rows are
+closed up by moving only the rows after the first one dropped, so a kernel or index can follow a few changed
+templates without copying all of them.
+"""
+class RowBuffer:
+
+    def __init__(self, rows):
+        self.buffer = rows
+        self.rows = rows
+
+    def append(self, rows):
+        row_count = len(self.rows)
+        stop = row_count + len(rows)
+        if stop > len(self.buffer) or not self.buffer.flags.writeable:
+            buffer = np.empty((max(stop, 2 * row_count, 16),) + self.rows.shape[1:], dtype=self.rows.dtype)
+            buffer[:row_count] = self.rows
+            self.buffer = buffer
+        self.buffer[row_count:stop] = rows
+        self.rows = self.buffer[:stop]
+
+    # Drops the rows whose entry in keep is False, keeping the others in order.
+    def keep(self, keep):
+        kept = np.flatnonzero(keep)
+        if len(kept) == len(self.rows):
+            return
+        if not self.buffer.flags.writeable:
+            self.buffer = self.rows = self.rows[kept]
+            return
+
+        first_removed = int(np.argmin(keep))
+        self.buffer[first_removed:len(kept)] = self.buffer[kept[first_removed:]]
+        self.rows = self.buffer[:len(kept)]
+
+"""
+L2Distance is the exact Euclidean distance. For uint8 crops and templates it is found from ||a||^2 + ||b||^2 - 2ab,
+with the squared norms of the templates found once when the kernel is built and the cross terms found a chunk of
+templates at a time. The testing rows, their norms and each chunk of templates are widened to float64 in the thread's
+workspace, and the distances are written to out when it is given, so a call allocates nothing once the workspace has
+grown to the batch size. Measuring only some templateIndices copies those rows first. Every sum is an integer below
+2^53, so the squared distances are exact and nothing wraps around. Other rows, such as projected ones, are subtracted
+in float64.
+"""
+class L2Distance:
+
+    def __init__(self, trainingMatrix, workspaceElements = WORKSPACE_ELEMENTS):
+        self.training_matrix = trainingMatrix
+        self.workspace_elements = workspaceElements
+        self.chunk_rows = max(1, workspaceElements // max(1, trainingMatrix.shape[1]))
+        self.norms = RowBuffer(squaredNorms(trainingMatrix, workspaceElements)) if trainingMatrix.dtype == np.uint8 else None
+        self.workspace = Workspace()
+
+    @property
+    def template_norms(self):
+        return self.norms.rows if self.norms is not None else None
+
+    # Follows templates added to the end of the training matrix, which is now trainingMatrix. Only the new rows
+    # are measured.
+    def add_rows(self, rows, trainingMatrix):
+        self.training_matrix = trainingMatrix
+        if self.norms is not None:
+            self.norms.append(squaredNorms(rows, self.workspace_elements))
+
+    # Follows the training matrix, now trainingMatrix, after the rows whose entry in keep is False were removed.
+    def keep_rows(self, keep, trainingMatrix):
+        self.training_matrix = trainingMatrix
+        if self.norms is not None:
+            self.norms.keep(keep)
+
+    # Squared distances from each row of the testing matrix to every template, or only to the templates at
+    # templateIndices, as an N x M matrix. They are written to out, a float64 N x M array, when it is given.
+    def squared_distances(self, testingMatrix, templateIndices = None, out = None):
+        training_matrix = self.training_matrix if templateIndices is None else self.training_matrix[templateIndices]
+        squared_distances = np.empty((len(testingMatrix), len(training_matrix))) if out is None else out
+        if len(training_matrix) == 0:
+            return squared_distances
+
+        width = training_matrix.shape[1]
+        chunk_rows = min(self.chunk_rows, len(training_matrix))
+        workspace = self.workspace.buffer(chunk_rows, width, np.float64)
+
+        if self.template_norms is not None and testingMatrix.dtype == np.uint8:
+            testing_matrix = self.workspace.buffer(len(testingMatrix), width, np.float64, 'testing')
+            testing_matrix[...] = testingMatrix
+            testing_norms = self.workspace.buffer(1, len(testingMatrix), np.float64, 'norms')[0]
+            np.einsum('nd,nd->n', testing_matrix, testing_matrix, out=testing_norms)
+
+            for start in range(0, len(training_matrix), chunk_rows):
+                stop = min(start + chunk_rows, len(training_matrix))
+                chunk = workspace[:stop - start]
+                chunk[...] = training_matrix[start:stop]
+                np.matmul(testing_matrix, chunk.T, out=squared_distances[:, start:stop])
+
+            template_norms = self.template_norms if templateIndices is None else self.template_norms[templateIndices]
+            squared_distances *= -2
+            squared_distances += testing_norms[:, np.newaxis]
+            squared_distances += template_norms[np.newaxis, :]
+            return squared_distances
+
+        for row, testing_vector in enumerate(testingMatrix):
+            for start in range(0, len(training_matrix), chunk_rows):
+                stop = min(start + chunk_rows, len(training_matrix))
+                chunk = workspace[:stop - start]
+                np.subtract(training_matrix[start:stop], testing_vector, out=chunk, dtype=np.float64)
+                np.einsum('md,md->m', chunk, chunk, out=squared_distances[row, start:stop])
+        return squared_distances
+
+    def distances(self, testingMatrix, templateIndices = None, out = None):
+        squared_distances = self.squared_distances(testingMatrix, templateIndices, out)
+        return np.sqrt(squared_distances, out=squared_distances)
+
+"""
+ExpandedL2Distance finds the Euclidean distance from ||a||^2 + ||b||^2 - 2ab. The squared norms of the templates are
+found exactly once, when the kernel is built, along with a float32 copy of the templates, and the cross terms of a
+whole batch of testing rows are then a single float32 matrix product. The float32 accumulation leaves squared
+distances within about one part in 10^6 of the exact ones, so near ties can be ordered differently than by L2Distance.
+"""
+class ExpandedL2Distance:
+
+    def __init__(self, trainingMatrix, workspaceElements = WORKSPACE_ELEMENTS):
+        self.workspace_elements = workspaceElements
+        self.templates = RowBuffer(trainingMatrix.astype(np.float32))
+        self.norms = RowBuffer(squaredNorms(trainingMatrix, workspaceElements))
+
+    # Converts and measures only the rows added to the end of the training matrix.
+    def add_rows(self, rows, trainingMatrix):
+        self.templates.append(rows.astype(np.float32))
+        self.norms.append(squaredNorms(rows, self.workspace_elements))
+
+    def keep_rows(self, keep, trainingMatrix):
+        self.templates.keep(keep)
+        self.norms.keep(keep)
+
+    def squared_distances(self, testingMatrix, templateIndices = None):
+        training_matrix = self.templates.rows if templateIndices is None else self.templates.rows[templateIndices]
+        template_norms = self.norms.rows if templateIndices is None else self.norms.rows[templateIndices]
+        if len(training_matrix) == 0:
+            return np.empty((len(testingMatrix), 0))
+
+        squared_distances = np.matmul(testingMatrix.astype(np.float32), training_matrix.T).astype(np.float64)
+        squared_distances *= -2
+        squared_distances += squaredNorms(testingMatrix)[:, np.newaxis]
+        squared_distances += template_norms[np.newaxis, :]
+        return np.maximum(squared_distances, 0, out=squared_distances)
+
+    def distances(self, testingMatrix, templateIndices = None):
+        return np.sqrt(self.squared_distances(testingMatrix, templateIndices))
+
+"""
+HammingDistance thresholds templates and crops to binary maps, packs them 8 pixels to a byte and counts the pixels
+that differ with XOR and popcount. Edge and foreground crops are close to binary, so the count is proportional to
+their squared Euclidean distance with about an eighth of the memory traffic. The distances are numbers of pixels.
+With packed set, the training matrix already holds packed rows, such as those of BinaryTemplates, and is used as is.
+"""
+class HammingDistance:
+
+    def __init__(self, trainingMatrix, threshold = BINARY_THRESHOLD, workspaceElements = WORKSPACE_ELEMENTS, packed = False):
+        self.threshold = threshold
+        self.packed = packed
+        self.bits = RowBuffer(trainingMatrix if packed else packBits(trainingMatrix, threshold))
+        self.chunk_rows = max(1, workspaceElements // max(1, self.training_bits.shape[1] * 8))
+        self.workspace = Workspace()
+
+    @property
+    def training_bits(self):
+        return self.bits.rows
+
+    # Packs only the rows added to the end of the training matrix. Packed rows are the training matrix itself.
+    def add_rows(self, rows, trainingMatrix):
+        if self.packed:
+            self.bits = RowBuffer(trainingMatrix)
+        else:
+            self.bits.append(packBits(rows, self.threshold))
+
+    def keep_rows(self, keep, trainingMatrix):
+        if self.packed:
+            self.bits = RowBuffer(trainingMatrix)
+        else:
+            self.bits.keep(keep)
+
+    # Pixels that differ between each row of the testing matrix and every template, or only the templates at
+    # templateIndices, as an N x M matrix.
+    def differing_pixels(self, testingMatrix, templateIndices = None):
+        training_bits = self.training_bits if templateIndices is None else self.training_bits[templateIndices]
+        testing_bits = packBits(testingMatrix, self.threshold)
+        return hammingDistances(testing_bits, training_bits, self.workspace, self.chunk_rows)
+
+    def distances(self, testingMatrix, templateIndices = None):
+        return self.differing_pixels(testingMatrix, templateIndices).astype(np.float64)
+
+"""
+BinaryTemplates holds the templates of one class as binary maps, thresholded and packed 8 pixels to a byte in rows of
+packedWidth() bytes, about 470 bytes for a 75 x 50 crop instead of 3750. A templates dictionary can hold them in place
+of the list or array of a class's images, and a KNeighborsClassifier measures them with Hamming distance without
+unpacking them.
+"""
+class BinaryTemplates:
+
+    def __init__(self, bits, imageShape = TEMPLATE_SHAPE, threshold = BINARY_THRESHOLD):
+        self.bits = bits
+        self.image_shape = tuple(imageShape)
+        self.threshold = threshold
+
+    def __len__(self):
+        return len(self.bits)
+
+    # The binary maps as (count, height, width) uint8 images of 0 and 255.
+    def unpack(self):
+        pixel_count = self.image_shape[0] * self.image_shape[1]
+        pixels = np.unpackbits(self.bits, axis=1, count=pixel_count) * np.uint8(255)
+        return pixels.reshape((len(self.bits),) + self.image_shape)
+
+# Thresholds and packs a list or stack of images into BinaryTemplates.
+def binaryTemplates(images, threshold = BINARY_THRESHOLD, imageShape = TEMPLATE_SHAPE):
+    if len(images) == 0:
+        return BinaryTemplates(np.zeros((0, packedWidth(imageShape[0] * imageShape[1])), dtype=np.uint8), imageShape, threshold)
+    images = images if isinstance(images, np.ndarray) else np.stack(images)
+    return BinaryTemplates(packBits(images, threshold), images.shape[1:], threshold)
+
+# Builds the kernel for the named metric over a matrix of templates, one template per row. A matrix of packed rows
+# can only be measured with Hamming distance.
+def distanceKernel(metric, trainingMatrix, packed = False, threshold = BINARY_THRESHOLD):
+    if packed:
+        if metric != 'hamming':
+            raise ValueError(f"Bit-packed templates cannot be measured with {metric} distance.")
+        return HammingDistance(trainingMatrix, threshold, packed=True)
+    elif metric == 'l2':
+        return L2Distance(trainingMatrix)
+    elif metric == 'l2-expanded':
+        return ExpandedL2Distance(trainingMatrix)
+    elif metric == 'hamming':
+        return HammingDistance(trainingMatrix, threshold)
+    raise ValueError(f"Unknown distance metric: {metric}")
+
+# Exact squared norm of every row, found a chunk of rows at a time.
+def squaredNorms(matrix, workspaceElements = WORKSPACE_ELEMENTS):
+    integer = matrix.dtype == np.uint8
+    norms = np.empty(len(matrix), dtype=np.int64 if integer else np.float64)
+    chunk_rows = max(1, workspaceElements // max(1, matrix.shape[1]))
+    for start in range(0, len(matrix), chunk_rows):
+        rows = matrix[start:start + chunk_rows]
+        if integer:
+            rows = rows.astype(np.int32)
+            np.add.reduce(rows * rows, axis=1, out=norms[start:start + chunk_rows])
+        else:
+            np.einsum('md,md->m', rows, rows, out=norms[start:start + chunk_rows], dtype=np.float64)
+    return norms.astype(np.float64)
+
+# Bytes in a packed row of a binary map with the given number of pixels.
+def packedWidth(pixelCount):
+    return -(-pixelCount // 64) * 8
+
+# Thresholds each row to a binary map and packs it 8 pixels to a byte. The rows are padded with zero bits to a
+# multiple of 8 bytes, so they can be compared as 64 bit words.
+def packBits(matrix, threshold = BINARY_THRESHOLD):
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    packed = np.zeros((len(matrix), packedWidth(matrix.shape[1])), dtype=np.uint8)
+    packed[:, :-(-matrix.shape[1] // 8)] = np.packbits(matrix > threshold, axis=1)
+    return packed
+
+# Number of bits that differ between each packed testing row and every packed template row, as an N x M matrix.
+def hammingDistances(testingBits, trainingBits, workspace, chunkRows):
+    training_words = trainingBits.view(np.uint64)
+    testing_words = testingBits.view(np.uint64)
+    counts = np.empty((len(testingBits), len(trainingBits)), dtype=np.int32)
+    if len(trainingBits) == 0:
+        return counts
+
+    chunk_rows = min(chunkRows, len(training_words))
+    differences = workspace.buffer(chunk_rows, training_words.shape[1], np.uint64)
+    for row, testing_vector in enumerate(testing_words):
+        for start in range(0, len(training_words), chunk_rows):
+            stop = min(start + chunk_rows, len(training_words))
+            chunk = differences[:stop - start]
+            np.bitwise_xor(training_words[start:stop], testing_vector, out=chunk)
+            counts[row, start:stop] = popcount(chunk)
+    return counts
+
+# Number of set bits in each row of a matrix of 64 bit words.
+def popcount(words):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return POPCOUNT_TABLE[words.view(np.uint16)].sum(axis=1, dtype=np.int32)
+
+# (thumbnailSize, size) matrix that shrinks a line of size pixels to thumbnailSize pixels. Each thumbnail pixel is
+# the mean of the pixels it covers, weighted by how much of each it covers, as cv2.INTER_AREA does.
+def areaWeights(size, thumbnailSize):
+    edges = np.arange(thumbnailSize + 1) * (size / thumbnailSize)
+    pixels = np.arange(size)
+    overlap = np.minimum(edges[1:, np.newaxis], pixels + 1) - np.maximum(edges[:-1, np.newaxis], pixels)
+    return (np.maximum(overlap, 0) * (thumbnailSize / size)).astype(np.float32)
+
+# Shrinks each row, an image of imageShape, to a thumbnail of thumbnailShape and returns the thumbnails as float32
+# rows. Packed rows are unpacked to binary maps of 0 and 255 first. When a threshold is given, the images are
+# thresholded to binary maps before they are shrunk, so their thumbnails show the maps Hamming distance compares.
+def thumbnails(matrix, imageShape = TEMPLATE_SHAPE, thumbnailShape = THUMBNAIL_SHAPE, packed = False, threshold = None,
+               workspaceElements = WORKSPACE_ELEMENTS):
+    height, width = imageShape
+    row_weights = areaWeights(height, thumbnailShape[0])
+    column_weights = areaWeights(width, thumbnailShape[1]).T
+
+    shrunk = np.empty((len(matrix), thumbnailShape[0] * thumbnailShape[1]), dtype=np.float32)
+    chunk_rows = max(1, workspaceElements // (height * width))
+    for start in range(0, len(matrix), chunk_rows):
+        rows = matrix[start:start + chunk_rows]
+        if packed:
+            rows = np.unpackbits(rows, axis=1, count=height * width) * np.float32(255)
+        elif threshold is not None:
+            rows = (rows.reshape(len(rows), -1) > threshold) * np.float32(255)
+        images = rows.reshape(len(rows), height, width).astype(np.float32, copy=False)
+        shrunk[start:start + chunk_rows] = (row_weights @ images @ column_weights).reshape(len(rows), -1)
+    return shrunk
+
+# Exact Euclidean distance between two crops, with the difference taken in a wider type so uint8 crops do not wrap.
+def euclideanDistance(source, target):
+    difference = np.subtract(source, target, dtype=np.float64)
+    return float(np.sqrt(np.sum(difference * difference)))
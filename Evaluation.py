@@ -0,0 +1,219 @@
+"""
+Evaluation.py checks the fall/no-fall verdicts of the Fall Detection System on the fall_samples videos, processing the
+videos in parallel, and is not apart of the actual System's code base.
+
+
+
+
+
+
+Copyright (c) 2020 Fall Detection System, All rights reserved.
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1.	Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2.	Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer
+    in the documentation and/or other materials provided with the distribution.
+
+3.	Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import argparse
+import sys
+import numpy as np
+from cv2 import cv2
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from timeit import default_timer as timer
+
+import ComputerVision
+import Distance
+import HumanStateClassifier
+import Profiler
+import Templates
+from Benchmarks import SAMPLE_VIDEOS
+
+# Classifiers and settings of a worker process, set once by initializeWorker().
+worker_state = {}
+
+"""
+VideoEvaluation is the outcome of running one video headless: the verdict against the expected label, the number of
+frames, the time taken, the latency of each frame and the FallEvents raised while the frames were classified, with
+the frame rate of the video to place them in it. When the video was profiled, profileSummary holds the summary rows
+of its Profiler.
+"""
+class VideoEvaluation:
+
+    def __init__(self, videoPath, expected, detected, frameLatencies, seconds, skipped = 0, fallEvents = (), videoFrameRate = 0,
+                 profileSummary = ()):
+        self.video_path = videoPath
+        self.expected = expected
+        self.detected = detected
+        self.frame_latencies = frameLatencies
+        self.seconds = seconds
+        self.skipped = skipped
+        self.fall_events = list(fallEvents)
+        self.video_frame_rate = videoFrameRate
+        self.profile_summary = list(profileSummary)
+
+    def passed(self):
+        return self.detected == self.expected
+
+    def frames(self):
+        return len(self.frame_latencies)
+
+    def frames_per_second(self):
+        return self.frames() / self.seconds if self.seconds > 0 else 0
+
+    def latency_ms(self, percentile = 50):
+        return 1000 * np.percentile(self.frame_latencies, percentile) if self.frames() > 0 else 0
+
+    # The first FallEvent, or None when no fall was raised.
+    def first_fall_event(self):
+        return self.fall_events[0] if len(self.fall_events) > 0 else None
+
+    # Seconds into the video at which the first fall was raised, or None.
+    def detected_at(self):
+        fall_event = self.first_fall_event()
+        if fall_event is None or self.video_frame_rate <= 0:
+            return None
+        return fall_event.frame_count / self.video_frame_rate
+
+    # Seconds of video from the first falling frame to the first fall being raised, or None.
+    def time_to_detect(self):
+        fall_event = self.first_fall_event()
+        if fall_event is None or self.video_frame_rate <= 0:
+            return None
+        return fall_event.frames_to_detect() / self.video_frame_rate
+
+# Loads the templates once in each worker process. A template pack is memory-mapped, so the workers share its pages.
+def initializeWorker(packPath, k, roiOnly, motionScale, motionGate, profile, metrics, binary, shortlistSize):
+    templates = Templates.loadTemplatesLocally(packPath=packPath, binary=binary)
+    index_mode = 'exact' if shortlistSize is None else 'cascade'
+    worker_state['edge'] = HumanStateClassifier.KNeighborsClassifier(templates['edge'], k=k, metric=metrics['edge'],
+                                                                     indexMode=index_mode, shortlistSize=shortlistSize)
+    worker_state['foreground'] = HumanStateClassifier.KNeighborsClassifier(templates['foreground'], k=k, metric=metrics['foreground'],
+                                                                           indexMode=index_mode, shortlistSize=shortlistSize)
+    worker_state['roi_only'] = roiOnly
+    worker_state['motion_scale'] = motionScale
+    worker_state['motion_gate'] = motionGate
+    worker_state['profile'] = profile
+
+# Runs one video headless with its own background model, so the verdict does not depend on the other videos.
+def evaluateVideo(videoPath, expected):
+    motion_gate = ComputerVision.MotionGate() if worker_state['motion_gate'] else None
+    profiler = Profiler.Profiler(videoPath, enabled=worker_state['profile'])
+    results = ComputerVision.processHeadless(worker_state['foreground'], worker_state['edge'], videoPath=videoPath,
+                                             backgroundSubtractor=ComputerVision.createBackgroundSubtractor(),
+                                             printFrameRate=False, roiOnly=worker_state['roi_only'],
+                                             motionScale=worker_state['motion_scale'], motionGate=motion_gate,
+                                             profiler=profiler)
+    frame_latencies = []
+    frame_results = []
+
+    start = timer()
+    frame_start = start
+    for result in results:
+        frame_end = timer()
+        frame_latencies.append(frame_end - frame_start)
+        frame_results.append(result)
+        frame_start = frame_end
+
+    capture = cv2.VideoCapture(videoPath)
+    video_frame_rate = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+
+    return VideoEvaluation(videoPath, expected, ComputerVision.fallDetected(frame_results), frame_latencies, timer() - start,
+                           skipped=sum(result.skipped for result in frame_results),
+                           fallEvents=[result.fall_event for result in frame_results if result.fall_event is not None],
+                           videoFrameRate=video_frame_rate, profileSummary=profiler.summary())
+
+# Evaluates the videos on a pool of worker processes and returns their VideoEvaluations in the order of videos.
+# metrics maps each template characteristic to the distance metric of its classifier. With binary set, the templates
+# are bit-packed and both classifiers measure them with Hamming distance. With shortlistSize set, the classifiers are
+# coarse-to-fine cascades that measure only that many templates at full resolution.
+def evaluate(videos = SAMPLE_VIDEOS, workers = None, packPath = Templates.TEMPLATE_PACK_PATH, k = 4, roiOnly = False, motionScale = 1,
+             motionGate = False, profile = False, metrics = None, binary = False, shortlistSize = None):
+    if binary:
+        metrics = {'edge': 'hamming', 'foreground': 'hamming'}
+    elif metrics is None:
+        metrics = {'edge': 'l2', 'foreground': 'l2'}
+    if workers is None:
+        workers = min(len(videos), cpu_count())
+
+    # Rebuilds an out of date template pack once here rather than in every worker.
+    Templates.loadTemplatesLocally(packPath=packPath, binary=binary)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializeWorker,
+                             initargs=(packPath, k, roiOnly, motionScale, motionGate, profile, metrics, binary,
+                                       shortlistSize)) as executor:
+        return list(executor.map(evaluateVideo, videos.keys(), videos.values()))
+
+def printEvaluations(evaluations, seconds):
+    print(f"{'video':<40}{'expected':>10}{'detected':>10}{'frames':>8}{'skipped':>9}{'fps':>8}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'events':>8}{'event at':>10}{'to detect':>11}  result")
+    for evaluation in evaluations:
+        detected_at = evaluation.detected_at()
+        time_to_detect = evaluation.time_to_detect()
+        print(f"{evaluation.video_path:<40}{'fall' if evaluation.expected else 'no fall':>10}{'fall' if evaluation.detected else 'no fall':>10}"
+              f"{evaluation.frames():>8}{evaluation.skipped:>9}{evaluation.frames_per_second():>8.1f}{evaluation.latency_ms(50):>9.1f}{evaluation.latency_ms(95):>9.1f}"
+              f"{len(evaluation.fall_events):>8}{'-' if detected_at is None else f'{detected_at:.2f} s':>10}"
+              f"{'-' if time_to_detect is None else f'{time_to_detect:.2f} s':>11}"
+              f"  {'ok' if evaluation.passed() else 'FAILED'}")
+
+    times_to_detect = [evaluation.time_to_detect() for evaluation in evaluations if evaluation.time_to_detect() is not None]
+    if len(times_to_detect) > 0:
+        print(f"Falls were raised on {len(times_to_detect)} videos, {np.mean(times_to_detect):.2f} s of video after the first falling "
+              f"frame on average (at most {max(times_to_detect):.2f} s).")
+
+    passed = sum(evaluation.passed() for evaluation in evaluations)
+    frames = sum(evaluation.frames() for evaluation in evaluations)
+    print(f"\n{passed}/{len(evaluations)} videos match their expected labels; {frames} frames in {seconds:.2f} s "
+          f"({frames / seconds if seconds > 0 else 0:.1f} frames/s overall).")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks the fall/no-fall verdicts on the sample videos. '
+                                                 'Exits with status 1 when any verdict differs from its expected label.')
+    parser.add_argument('videos', nargs='*', help='Sample videos to evaluate, all of them by default.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--pack', default=Templates.TEMPLATE_PACK_PATH)
+    parser.add_argument('--roi', action='store_true', help='Process only the region of interest around each bounding box.')
+    parser.add_argument('--motion-scale', type=int, choices=[1, 2, 4], default=1, help='Find movement on a frame scaled down by this factor.')
+    parser.add_argument('--motion-gate', action='store_true', help='Skip the frames of a static scene.')
+    parser.add_argument('--edge-metric', choices=Distance.METRICS, default='l2', help='Distance metric of the edge classifier.')
+    parser.add_argument('--foreground-metric', choices=Distance.METRICS, default='l2', help='Distance metric of the foreground classifier.')
+    parser.add_argument('--binary', action='store_true', help='Load bit-packed templates and compare them with Hamming distance.')
+    parser.add_argument('--shortlist', type=int, default=None,
+                        help='Shortlist this many templates by their thumbnails and measure only those at full resolution.')
+    parser.add_argument('--profile', metavar='PATH', default=None, help='Time every stage and write the summary to a .csv or .json file.')
+    arguments = parser.parse_args()
+
+    videos = SAMPLE_VIDEOS
+    if len(arguments.videos) > 0:
+        unknown = [video for video in arguments.videos if video not in SAMPLE_VIDEOS]
+        if len(unknown) > 0:
+            parser.error(f"no expected label for {', '.join(unknown)}")
+        videos = {video: SAMPLE_VIDEOS[video] for video in arguments.videos}
+
+    start = timer()
+    evaluations = evaluate(videos, workers=arguments.workers, packPath=arguments.pack, k=arguments.k, roiOnly=arguments.roi,
+                           motionScale=arguments.motion_scale, motionGate=arguments.motion_gate,
+                           profile=arguments.profile is not None,
+                           metrics={'edge': arguments.edge_metric, 'foreground': arguments.foreground_metric},
+                           binary=arguments.binary, shortlistSize=arguments.shortlist)
+    printEvaluations(evaluations, timer() - start)
+    if arguments.profile is not None:
+        rows = [row for evaluation in evaluations for row in evaluation.profile_summary]
+        Profiler.printSummary(rows)
+        Profiler.exportSummary(rows, arguments.profile)
+    sys.exit(0 if all(evaluation.passed() for evaluation in evaluations) else 1)
@@ -23,15 +23,12 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
 POSSIBILITY OF SUCH DAMAGE.
 
 """
+import hashlib
 import numpy as np
-from timeit import default_timer as timer
+import zipfile
+from os import path, replace
 
-# Allows the use of a max heap in python.
-# This is the predicted optimal datastrucutre to contain the neighbors calculated Euclidean distance measure as
-# we would only extract the highest value O(1), insert a new value (log(n)) or extract the max value (log(n)).
-# NOTE: Heapq is noramlly implements a heap as a min heap, to use it as a max heap, 
-# all values will be multiplied by -1
-from heapq import heappop, heappush, heapify
+import Distance
 
 
 """
@@ -39,6 +36,8 @@ DistanceAndClass referenced and defined in section 2.0 of the SDD, A03_SDD_Team4
 
 """
 class DistanceAndClass:
+    __slots__ = ('distance', 'classification')
+
     def __init__(self, distance, classification):
         self.distance = distance
         self.classification = classification
@@ -50,9 +49,282 @@ class DistanceAndClass:
     def __str__(self):
         return (f"{self.distance},{self.classification}")
 
+# Record type for many DistanceAndClass pairs at once. The classification is the index of the class in
+# KNeighborsClassifier.classes.
+DISTANCE_AND_CLASS_DTYPE = np.dtype([('distance', np.float64), ('classification', np.int16)])
+
+# Builds a record array from matching arrays of distances and class indices, without a DistanceAndClass per pair.
+def distanceAndClassRecords(distances, classifications):
+    records = np.empty(np.shape(distances), dtype=DISTANCE_AND_CLASS_DTYPE)
+    records['distance'] = distances
+    records['classification'] = classifications
+    return records
+
+"""
+EigenTemplates is a dimensionality reduction stage for KNeighborsClassifier. It fits a basis of eigen-templates (the
+leading principal components of the template set) once, and templates and crops are then compared by their coordinates
+in that basis instead of pixel by pixel. Most template pixels are empty, so a few dozen coordinates keep nearly all of
+the variation. The fitted basis can be cached to disk and is reused as long as the templates it was fitted on are
+unchanged.
+"""
+class EigenTemplates:
+
+    # Rows used to fit the basis and rows projected at a time.
+    sample_count = 2000
+    chunk_size = 4096
+
+    # np.savez() adds .npz to a cachePath without it, so the path is given the extension here to load from the same file.
+    def __init__(self, dimensions = 48, cachePath = None, seed = 450):
+        if cachePath is not None and not str(cachePath).endswith('.npz'):
+            cachePath = f"{cachePath}.npz"
+
+        self.dimensions = dimensions
+        self.cache_path = cachePath
+        self.seed = seed
+        self.mean = None
+        self.components = None
+        self.fingerprint = None
+
+    def fitted(self):
+        return self.components is not None
+
+    # Fits the basis on the rows of the training matrix, or loads it from the cache when it was fitted on the same rows.
+    def fit(self, trainingMatrix):
+        fingerprint = None
+        if self.cache_path is not None:
+            fingerprint = hashlib.sha1(np.ascontiguousarray(trainingMatrix).tobytes()).hexdigest()
+            fingerprint = f"{fingerprint}-{self.dimensions}-{self.sample_count}-{self.seed}"
+            if self.load(fingerprint):
+                return self
+
+        random = np.random.default_rng(self.seed)
+        sample_count = min(len(trainingMatrix), self.sample_count)
+        sample = trainingMatrix[np.sort(random.choice(len(trainingMatrix), sample_count, replace=False))]
+        sample = sample.astype(np.float32)
+
+        self.mean = sample.mean(axis=0)
+        _, _, components = np.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = np.ascontiguousarray(components[:self.dimensions].T, dtype=np.float32)
+        self.fingerprint = fingerprint
+
+        if self.cache_path is not None:
+            self.save()
+        return self
+
+    # Coordinates of each row of the matrix in the eigen-template basis.
+    def project(self, matrix):
+        projected = np.empty((len(matrix), self.components.shape[1]), dtype=np.float32)
+        for start in range(0, len(matrix), self.chunk_size):
+            chunk = matrix[start:start + self.chunk_size].astype(np.float32) - self.mean
+            projected[start:start + self.chunk_size] = chunk @ self.components
+        return projected
+
+    # Writes the cache to a temporary file first, so an interrupted save never leaves a partly written cache behind.
+    def save(self):
+        temporary_path = f"{self.cache_path}.tmp"
+        try:
+            with open(temporary_path, 'wb') as cache_file:
+                np.savez(cache_file, mean=self.mean, components=self.components, fingerprint=self.fingerprint)
+            replace(temporary_path, self.cache_path)
+        except OSError as error:
+            print(error)
+
+    # Loads the basis from the cache when it was fitted with the fingerprint. A cache that cannot be read, such as
+    # a corrupt one, is treated as missing, so the basis is fitted again and the cache rewritten.
+    def load(self, fingerprint):
+        if not path.exists(self.cache_path):
+            return False
+
+        try:
+            with np.load(self.cache_path) as cache:
+                if str(cache['fingerprint']) != fingerprint:
+                    return False
+                mean = cache['mean']
+                components = cache['components']
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as error:
+            print(error)
+            return False
+
+        self.mean = mean
+        self.components = components
+        self.fingerprint = fingerprint
+        return True
+
+"""
+ApproximateNeighborIndex is an optional search structure for KNeighborsClassifier when the template set is too large
+for an exhaustive scan. Templates are projected onto a small EigenTemplates basis and split into a forest of
+random projection trees. A query descends every tree to a leaf, the union of those leaves is cut down to the
+candidate_count closest in the projected space, and only that shortlist is measured at full resolution.
+"""
+class ApproximateNeighborIndex:
+
+    def __init__(self, trainingMatrix, dimensions = 32, treeCount = 8, leafSize = 64, candidateCount = 128, seed = 450):
+        self.tree_count = treeCount
+        self.leaf_size = leafSize
+        self.candidate_count = candidateCount
+
+        random = np.random.default_rng(seed)
+        self.projection = EigenTemplates(dimensions=dimensions, seed=seed).fit(trainingMatrix)
+        self.projected = Distance.RowBuffer(self.projection.project(trainingMatrix))
+        self.built_count = len(trainingMatrix)
+
+        # Split nodes of every tree share these lists so that a query evaluates all directions in one product.
+        self.split_directions = []
+        self.split_thresholds = []
+        self.split_children = []
+        self.trees = [self.build_tree(random) for _ in range(self.tree_count)]
+        self.split_directions = np.array(self.split_directions, dtype=np.float32).reshape(-1, self.projected_templates.shape[1])
+        self.split_thresholds = np.array(self.split_thresholds, dtype=np.float32)
+
+    # Splits the projected templates at the median along random directions until every leaf holds at most leaf_size templates.
+    # Split nodes point to their children by index; a negative index -n - 1 refers to leaf n of the same tree.
+    def build_tree(self, random):
+        leaves = []
+
+        def build_node(members):
+            if len(members) <= self.leaf_size:
+                leaves.append(members)
+                return -len(leaves)
+
+            # The direction between two random members follows the spread of the data better than a random vector.
+            first, second = self.projected_templates[random.choice(members, 2, replace=False)]
+            direction = first - second
+            projections = self.projected_templates[members] @ direction
+            threshold = np.median(projections)
+            right = projections > threshold
+            if right.all() or not right.any():
+                leaves.append(members)
+                return -len(leaves)
+
+            node = len(self.split_children)
+            self.split_directions.append(direction)
+            self.split_thresholds.append(threshold)
+            self.split_children.append([0, 0])
+            self.split_children[node][0] = build_node(members[~right])
+            self.split_children[node][1] = build_node(members[right])
+            return node
+
+        root = build_node(np.arange(len(self.projected_templates)))
+        return root, leaves
+
+    @property
+    def projected_templates(self):
+        return self.projected.rows
+
+    # Index of the leaf each projected point reaches in every tree, as a (trees, points) array.
+    def leaf_indices(self, points):
+        go_right = (points @ self.split_directions.T > self.split_thresholds).astype(np.intp)
+        leaf_indices = np.empty((len(self.trees), len(points)), dtype=np.intp)
+        for tree, (root, _) in enumerate(self.trees):
+            for point in range(len(points)):
+                node = root
+                while node >= 0:
+                    node = self.split_children[node][go_right[point, node]]
+                leaf_indices[tree, point] = -node - 1
+        return leaf_indices
+
+    # Adds templates appended to the end of the training matrix to the leaves they reach, without moving the splits.
+    def add_rows(self, rows):
+        start = len(self.projected_templates)
+        points = self.projection.project(rows)
+        self.projected.append(points)
+
+        for (_, leaves), tree_leaves in zip(self.trees, self.leaf_indices(points)):
+            for template_index, leaf in enumerate(tree_leaves, start):
+                leaves[leaf] = np.append(leaves[leaf], template_index)
+
+    # Drops the templates whose entry in keep is False and renumbers the others.
+    def keep_rows(self, keep):
+        self.projected.keep(keep)
+        new_indices = np.cumsum(keep) - 1
+        for _, leaves in self.trees:
+            for leaf, members in enumerate(leaves):
+                leaves[leaf] = new_indices[members[keep[members]]]
+
+    # Returns the sorted indices of the templates worth measuring exactly for the testing vector.
+    def candidates(self, testing_vector):
+        point = self.projection.project(testing_vector[np.newaxis, :])[0]
+        found = [leaves[leaf] for (_, leaves), leaf in zip(self.trees, self.leaf_indices(point[np.newaxis, :])[:, 0])]
+        candidates = np.unique(np.concatenate(found))
+
+        if len(candidates) > self.candidate_count:
+            difference = self.projected_templates[candidates] - point
+            projected_distances = np.einsum('ij,ij->i', difference, difference)
+            candidates = np.sort(candidates[np.argpartition(projected_distances, self.candidate_count - 1)[:self.candidate_count]])
+
+        return candidates
+
+    # The candidates of each row of the testing matrix.
+    def candidate_lists(self, testing_matrix):
+        return [self.candidates(testing_vector) for testing_vector in testing_matrix]
+
+"""
+CascadeIndex is a coarse-to-fine search for KNeighborsClassifier. Every template is shrunk to a small thumbnail when
+the index is built, and a query is first compared with all of the thumbnails. Only the shortlist_size templates with
+the closest thumbnails are measured at full resolution, where the usual weighted vote picks the classification.
+Templates that are measured with Hamming distance are thresholded to binary maps before they are shrunk.
+"""
+class CascadeIndex:
+
+    def __init__(self, trainingMatrix, imageShape, shortlistSize = 256, thumbnailShape = Distance.THUMBNAIL_SHAPE,
+                 packed = False, threshold = None, missing = None):
+        if imageShape is None or len(imageShape) != 2:
+            raise ValueError("A cascade needs templates that are images.")
+        if shortlistSize < 1:
+            raise ValueError(f"A cascade needs a shortlist of at least one template, not {shortlistSize}.")
+
+        self.image_shape = tuple(imageShape)
+        self.thumbnail_shape = tuple(thumbnailShape)
+        self.shortlist_size = shortlistSize
+        self.threshold = threshold
+        self.packed = packed
+        self.thumbnail_kernel = Distance.ExpandedL2Distance(self.shrink(trainingMatrix))
+
+        # Missing templates are a distance of 1 from everything at full resolution, so they are always shortlisted.
+        self.missing = Distance.RowBuffer(np.zeros(len(trainingMatrix), dtype=bool) if missing is None else missing.copy())
+
+    @property
+    def thumbnails(self):
+        return self.thumbnail_kernel.templates.rows
+
+    def shrink(self, rows):
+        return Distance.thumbnails(rows, self.image_shape, self.thumbnail_shape, packed=self.packed, threshold=self.threshold)
+
+    # Shrinks only the templates appended to the end of the training matrix.
+    def add_rows(self, rows):
+        thumbnails = self.shrink(rows)
+        self.thumbnail_kernel.add_rows(thumbnails, None)
+        self.missing.append(np.zeros(len(rows), dtype=bool))
+
+    def keep_rows(self, keep):
+        self.thumbnail_kernel.keep_rows(keep, None)
+        self.missing.keep(keep)
+
+    # Returns the sorted indices of the templates worth measuring exactly for the testing vector.
+    def candidates(self, testing_vector):
+        return self.candidate_lists(testing_vector[np.newaxis, :])[0]
+
+    # The shortlist of each row of the testing matrix, found by comparing a chunk of rows with every thumbnail at once.
+    def candidate_lists(self, testing_matrix):
+        template_count = len(self.thumbnails)
+        if template_count <= self.shortlist_size:
+            return [np.arange(template_count)] * len(testing_matrix)
+
+        shortlists = []
+        chunk_rows = max(1, Distance.WORKSPACE_ELEMENTS // template_count)
+        for start in range(0, len(testing_matrix), chunk_rows):
+            testing_thumbnails = Distance.thumbnails(testing_matrix[start:start + chunk_rows], self.image_shape,
+                                                     self.thumbnail_shape, threshold=self.threshold)
+            coarse_distances = self.thumbnail_kernel.squared_distances(testing_thumbnails)
+            coarse_distances[:, self.missing.rows] = -1
+            shortlist = np.argpartition(coarse_distances, self.shortlist_size - 1, axis=1)[:, :self.shortlist_size]
+            shortlists.extend(np.sort(shortlist, axis=1))
+        return shortlists
+
 """
 KNeighborsClassifier referenced and defined in section 2.0 of the SDD, A03_SDD_Team4.docx. 
-Max Heap referenced and defined in section 2.0 of the SDD, A03_SDD_Team4.docx, and is utilized in the KNeighborsClassifier Class.
+Max Heap referenced and defined in section 2.0 of the SDD, A03_SDD_Team4.docx. The KNeighborsClassifier Class now selects the
+k nearest neighbors from a packed template matrix with a partial sort (numpy argpartition) instead of a heap.
 
 The Functional Requirement:
 
@@ -62,62 +334,453 @@ FR.5 The system must be able to differentiate between when a person falls down a
 is addressed in the classify() method of the KNeighborsClassifier class.
 """
 class KNeighborsClassifier:
-    def __init__(self, trainingDataset, k = None):
-        self.training_dataset = trainingDataset
 
+    # Upper bound on the number of pixel differences classify_many() holds in memory at once.
+    batch_element_limit = 2 ** 21
+
+    # indexMode is 'exact' for a scan of every template, 'approximate' to search an ApproximateNeighborIndex or 'cascade'
+    # to measure only the shortlistSize templates a CascadeIndex finds from their thumbnails.
+    # projection is an optional EigenTemplates stage; it is fitted on the training dataset and both templates and
+    # testing items are then compared in its reduced space. metric is one of Distance.METRICS, so the edge and
+    # foreground classifiers can each measure their templates in the way that suits them. A training dataset of
+    # Distance.BinaryTemplates is kept bit-packed and is measured with 'hamming'.
+    def __init__(self, trainingDataset, k = None, indexMode = 'exact', projection = None, metric = 'l2', shortlistSize = 256):
         if k is not None:
             self.k = k
         else:
             self.k = 5
 
+        self.index_mode = indexMode
+        self.shortlist_size = shortlistSize
+        self.projection = projection
+        self.metric = metric
+        if metric == 'hamming' and projection is not None:
+            raise ValueError("Hamming distance needs binary maps and cannot be used with a projection.")
+        self.set_training_dataset(trainingDataset)
+
     def set_training_dataset(self, trainingData):
         self.training_dataset = trainingData
+        self.pack_training_dataset()
+        self.build_index()
 
     def set_k(self, val):
         self.k = val
 
+    def set_index_mode(self, indexMode):
+        self.index_mode = indexMode
+        self.build_index()
+
+    def set_shortlist_size(self, shortlistSize):
+        self.shortlist_size = shortlistSize
+        self.build_index()
+
+    def set_metric(self, metric):
+        if metric == 'hamming' and self.projection is not None:
+            raise ValueError("Hamming distance needs binary maps and cannot be used with a projection.")
+        if self.binary and metric != 'hamming':
+            raise ValueError(f"Bit-packed templates cannot be measured with {metric} distance.")
+        self.metric = metric
+        self.build_index()
+
+    # Packs every template into one contiguous matrix (one row per template) so that all distances
+    # can be computed in a single matrix operation instead of a loop over templates.
+    def pack_training_dataset(self):
+        self.classes = list(self.training_dataset.keys())
+        class_items = [self.training_dataset[classification] for classification in self.classes]
+        class_items = [training_items if training_items is not None else [] for training_items in class_items]
+
+        self.binary = any(isinstance(training_items, Distance.BinaryTemplates) for training_items in class_items)
+        if self.binary:
+            self.pack_binary_templates(class_items)
+        elif all(isinstance(training_items, np.ndarray) for training_items in class_items):
+            self.pack_template_stacks(class_items)
+        else:
+            self.pack_template_lists(class_items)
+
+        if self.projection is not None and (~self.training_missing).any():
+            self.projection.fit(self.training_matrix[~self.training_missing])
+            self.training_matrix = self.projection.project(self.training_matrix)
+
+        # Rows are only tied to database template_ids once set_template_ids() is called.
+        self.training_ids = np.full(len(self.training_labels), -1, dtype=np.int64)
+        self.training_buffer = None
+
+    # Ties each packed row to a template_id. templateIds maps each class to the ids of its templates,
+    # in the same order as the training dataset the classifier was packed from.
+    def set_template_ids(self, templateIds):
+        template_ids = []
+        for classification in self.classes:
+            template_ids.extend(templateIds.get(classification, []))
+
+        if len(template_ids) != len(self.training_labels):
+            raise ValueError(f"Expected {len(self.training_labels)} template ids, got {len(template_ids)}.")
+        self.training_ids = np.array(template_ids, dtype=np.int64)
+
+    # Adds templates of one class to the packed matrix. The rows are written into spare capacity at the end
+    # of a buffer that grows geometrically, so only the new templates are copied and nothing is repacked, and
+    # the distance kernel and index only measure the new rows.
+    def add_templates(self, templateType, trainingItems, templateIds = None):
+        if len(trainingItems) == 0:
+            return
+        if templateIds is None:
+            templateIds = [-1] * len(trainingItems)
+
+        if templateType not in self.classes:
+            self.classes.append(templateType)
+
+        if self.template_shape is None:
+            self.template_shape = trainingItems.image_shape if isinstance(trainingItems, Distance.BinaryTemplates) else trainingItems[0].shape
+        if isinstance(trainingItems, Distance.BinaryTemplates):
+            rows = trainingItems.bits
+        elif self.binary:
+            rows = Distance.packBits(np.stack(trainingItems), self.binary_threshold)
+        else:
+            rows = np.stack([training_item.reshape(-1) for training_item in trainingItems])
+        if self.projection is not None:
+            if not self.projection.fitted():
+                self.projection.fit(rows)
+            rows = self.projection.project(rows)
+
+        start = len(self.training_labels)
+        stop = start + len(rows)
+        matrix_type = self.training_matrix.dtype
+        self.reserve_rows(stop, rows)
+        self.training_buffer[start:stop] = rows
+
+        self.training_matrix = self.training_buffer[:stop]
+        self.training_labels = np.append(self.training_labels, np.full(len(rows), self.classes.index(templateType), dtype=np.intp))
+        self.training_missing = np.append(self.training_missing, np.zeros(len(rows), dtype=bool))
+        self.training_ids = np.append(self.training_ids, np.array(templateIds, dtype=np.int64))
+        if start == 0 or self.training_matrix.dtype != matrix_type:
+            self.build_index()
+        else:
+            self.add_index_rows(self.training_matrix[start:stop])
+
+    # Removes the templates with the given template_ids. The rows after the first removed one are moved up
+    # in place, keeping the templates in order, and the distance kernel and index drop the same rows. Returns
+    # the number of templates removed.
+    def remove_templates(self, templateIds):
+        keep = ~np.isin(self.training_ids, np.array(list(templateIds), dtype=np.int64))
+        if keep.all():
+            return 0
+
+        kept = np.flatnonzero(keep)
+        first_removed = int(np.argmin(keep))
+        self.reserve_rows(len(self.training_labels), self.training_matrix[:0])
+        self.training_buffer[first_removed:len(kept)] = self.training_buffer[kept[first_removed:]]
+
+        self.training_matrix = self.training_buffer[:len(kept)]
+        self.training_labels = self.training_labels[kept]
+        self.training_missing = self.training_missing[kept]
+        self.training_ids = self.training_ids[kept]
+        if len(kept) == 0:
+            self.build_index()
+        else:
+            self.distance_kernel.keep_rows(keep, self.training_matrix)
+            if self.index is not None:
+                self.index.keep_rows(keep)
+        return len(keep) - len(kept)
+
+    # Makes sure the packed matrix lies at the start of a writable buffer with room for rowCount rows of the
+    # given rows' width, copying it into a new buffer of at least twice the size when it does not. A matrix
+    # viewing a template pack is copied the first time it changes.
+    def reserve_rows(self, rowCount, rows):
+        row_count = len(self.training_labels)
+        if row_count == 0:
+            matrix_type = rows.dtype
+            width = rows.shape[1]
+        else:
+            matrix_type = np.result_type(self.training_matrix.dtype, rows.dtype)
+            width = self.training_matrix.shape[1]
+            if rows.shape[1] != width:
+                raise ValueError(f"Templates of {rows.shape[1]} values cannot be added to templates of {width} values.")
+
+        buffer = self.training_buffer
+        if buffer is not None and buffer.dtype == matrix_type and buffer.shape[1] == width and len(buffer) >= rowCount:
+            return
+
+        capacity = max(rowCount, 2 * row_count, 16)
+        buffer = np.zeros((capacity, width), dtype=matrix_type)
+        if row_count > 0:
+            buffer[:row_count] = self.training_matrix
+        self.training_buffer = buffer
+        self.training_matrix = buffer[:row_count]
+
+    # Packs classes given as lists of templates.
+    def pack_template_lists(self, class_items):
+        rows = []
+        labels = []
+        for class_index, training_items in enumerate(class_items):
+            for training_item in training_items:
+                rows.append(training_item)
+                labels.append(class_index)
+
+        templates = [row for row in rows if row is not None]
+        template_size = templates[0].size if len(templates) > 0 else 0
+
+        # Templates decoded from PNG are uint8 and are kept that way, which lets the distance
+        # kernels use integer arithmetic; anything else is packed as float32.
+        if all(template.dtype == np.uint8 for template in templates):
+            matrix_type = np.uint8
+        else:
+            matrix_type = np.float32
+
+        self.training_matrix = np.zeros((len(rows), template_size), dtype=matrix_type)
+        for row_index, training_item in enumerate(rows):
+            if training_item is not None:
+                self.training_matrix[row_index] = training_item.reshape(-1)
+
+        self.training_labels = np.array(labels, dtype=np.intp)
+        self.template_shape = templates[0].shape if len(templates) > 0 else None
+        # A missing template has always been treated as a distance of 1 from everything.
+        self.training_missing = np.array([row is None for row in rows], dtype=bool)
+
+    # Packs classes given as (count, height, width) arrays, such as the memory-mapped views of a template pack.
+    def pack_template_stacks(self, class_items):
+        class_rows = [training_items.reshape(len(training_items), -1) for training_items in class_items]
+
+        self.template_shape = next((training_items.shape[1:] for training_items in class_items if len(training_items) > 0), None)
+        self.training_matrix = joinRows(class_rows)
+        self.training_labels = np.repeat(np.arange(len(class_rows)), [len(rows) for rows in class_rows])
+        self.training_missing = np.zeros(len(self.training_labels), dtype=bool)
+
+    # Packs classes given as Distance.BinaryTemplates. Their packed rows are joined without unpacking them, so the
+    # classes of a bit-packed template pack are used in place. Every class must be bit-packed, or empty.
+    def pack_binary_templates(self, class_items):
+        if any(len(training_items) > 0 and not isinstance(training_items, Distance.BinaryTemplates) for training_items in class_items):
+            raise ValueError("Bit-packed templates cannot be mixed with template images.")
+        if self.projection is not None:
+            raise ValueError("Bit-packed templates cannot be used with a projection.")
+
+        binary_items = [training_items for training_items in class_items if isinstance(training_items, Distance.BinaryTemplates)]
+        self.binary_threshold = binary_items[0].threshold
+        self.template_shape = binary_items[0].image_shape
+        packed_width = binary_items[0].bits.shape[1]
+        class_rows = [training_items.bits if isinstance(training_items, Distance.BinaryTemplates) else np.zeros((0, packed_width), dtype=np.uint8)
+                      for training_items in class_items]
+
+        self.training_matrix = joinRows(class_rows)
+        self.training_labels = np.repeat(np.arange(len(class_rows)), [len(rows) for rows in class_rows])
+        self.training_missing = np.zeros(len(self.training_labels), dtype=bool)
+
+    # Flattens the testing items to rows, projecting them into the eigen-template basis when one is in use.
+    def testing_matrix(self, testing_items):
+        testing_matrix = testing_items.reshape(len(testing_items), -1)
+        if self.projection is not None:
+            testing_matrix = self.projection.project(testing_matrix)
+        return testing_matrix
+
+    # Builds the distance kernel for the packed templates and, in 'approximate' or 'cascade' mode, the index over them.
+    def build_index(self):
+        if self.binary:
+            self.distance_kernel = Distance.distanceKernel(self.metric, self.training_matrix, packed=True, threshold=self.binary_threshold)
+        else:
+            self.distance_kernel = Distance.distanceKernel(self.metric, self.training_matrix)
+        if self.binary and self.index_mode == 'approximate':
+            raise ValueError("Bit-packed templates cannot be searched with an approximate index.")
+        if self.index_mode == 'cascade' and self.projection is not None:
+            raise ValueError("A cascade needs template images and cannot be used with a projection.")
+        if self.index_mode == 'approximate' and len(self.training_labels) > 0:
+            self.index = ApproximateNeighborIndex(self.training_matrix)
+        elif self.index_mode == 'cascade' and len(self.training_labels) > 0:
+            threshold = self.binary_threshold if self.binary else Distance.BINARY_THRESHOLD if self.metric == 'hamming' else None
+            self.index = CascadeIndex(self.training_matrix, self.template_shape, self.shortlist_size, packed=self.binary,
+                                      threshold=threshold, missing=self.training_missing)
+        elif self.index_mode in ('exact', 'approximate', 'cascade'):
+            self.index = None
+        else:
+            raise ValueError(f"Unknown index mode: {self.index_mode}")
+
+    # Brings the distance kernel and the index up to date with rows added to the end of the packed matrix. An
+    # approximate index is built again once the templates have doubled since it was built, as its splits only
+    # follow the templates it was built on.
+    def add_index_rows(self, rows):
+        self.distance_kernel.add_rows(rows, self.training_matrix)
+        if isinstance(self.index, ApproximateNeighborIndex) and len(self.training_labels) > 2 * self.index.built_count:
+            self.index = ApproximateNeighborIndex(self.training_matrix)
+        elif self.index is not None:
+            self.index.add_rows(rows)
+
+    # Distance from the testing item to every packed template.
+    def distances(self, testing_item):
+        if testing_item is None:
+            return np.ones(len(self.training_labels))
+        return self.batch_distances(self.testing_matrix(testing_item[np.newaxis]))[0]
+
+    # Distances in the classifier's metric from each row of the testing matrix to every packed template, as an
+    # N x M matrix. When template indices are given, only those templates are measured and the columns follow their order.
+    def batch_distances(self, testing_matrix, templateIndices = None):
+        training_missing = self.training_missing if templateIndices is None else self.training_missing[templateIndices]
+
+        distances = self.distance_kernel.distances(testing_matrix, templateIndices)
+        distances[:, training_missing] = 1
+        return distances
+
+    # Returns the column indices of the k smallest distances in each row of the N x M distance matrix.
+    def nearest_neighbors(self, distances):
+        k = min(self.k, distances.shape[1])
+        if k == distances.shape[1]:
+            return np.tile(np.arange(k), (len(distances), 1))
+
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        kth_distances = np.take_along_axis(distances, nearest, axis=1).max(axis=1)
+
+        # Earlier templates win ties at the k-th distance. Ties are rare, so only those rows are redone.
+        tied_rows = np.flatnonzero((distances <= kth_distances[:, np.newaxis]).sum(axis=1) > k)
+        for row in tied_rows:
+            closer = np.flatnonzero(distances[row] < kth_distances[row])
+            tied = np.flatnonzero(distances[row] == kth_distances[row])[:k - len(closer)]
+            nearest[row] = np.concatenate((closer, tied))
+
+        return nearest
+
+    # Sums the inverse distance weighted votes of the neighbors for each class, one row per testing item. A neighbor
+    # at a distance of 0 has always had a vote of 1.
+    def weighted_votes(self, neighborDistances, neighborLabels):
+        votes = np.zeros((len(neighborDistances), len(self.classes)))
+        rows = np.arange(len(neighborDistances))[:, np.newaxis]
+        neighbor_votes = np.divide(1.0, neighborDistances, out=np.ones(np.shape(neighborDistances)), where=neighborDistances != 0)
+        np.add.at(votes, (rows, neighborLabels), neighbor_votes)
+        return votes
+
+    # Weighted votes of the k nearest templates to each testing item, as an N x len(classes) matrix.
+    def vote(self, distances, templateIndices = None):
+        neighbors = self.nearest_neighbors(distances)
+        neighbor_distances = np.take_along_axis(distances, neighbors, axis=1)
+        if templateIndices is not None:
+            neighbors = templateIndices[neighbors]
+        return self.weighted_votes(neighbor_distances, self.training_labels[neighbors])
+
+    def vote_classification(self, votes):
+        if len(votes) == 0 or votes.max() < .0008:
+            return "unrecognized"
+        return self.classes[int(np.argmax(votes))]
+
+    # Votes for a single testing item.
+    def item_votes(self, testing_item):
+        if self.index is None or testing_item is None:
+            return self.vote(self.distances(testing_item)[np.newaxis, :])[0]
+
+        return self.index_votes(self.testing_matrix(testing_item[np.newaxis]))[0]
+
+    # Votes for each row of the testing matrix, measuring only the candidates the index returns for that row.
+    def index_votes(self, testing_matrix):
+        votes = np.zeros((len(testing_matrix), len(self.classes)))
+        for row, candidates in enumerate(self.index.candidate_lists(testing_matrix)):
+            distances = self.batch_distances(testing_matrix[row:row + 1], candidates)
+            votes[row] = self.vote(distances, candidates)[0]
+        return votes
+
+    # Votes for each row of the testing matrix from a scan of every template, a chunk of rows at a time.
+    def scan_votes(self, testing_matrix, chunkSize = None):
+        if chunkSize is None:
+            chunkSize = self.default_chunk_size()
+
+        votes = np.zeros((len(testing_matrix), len(self.classes)))
+        for start in range(0, len(testing_matrix), chunkSize):
+            votes[start:start + chunkSize] = self.vote(self.batch_distances(testing_matrix[start:start + chunkSize]))
+        return votes
+
     # K Nearest Neighbors algorithm
     def classify(self, testing_item):
-        classification = None
-        neighbors = []
-        heapify(neighbors)
-
-        for classification_set in self.training_dataset.items():
-            classification = classification_set[0]
-            for training_item in classification_set[1]:
-                sum_euclidean = self.euclidean_distance(testing_item, training_item)
-                distance_and_class = DistanceAndClass(-1 * sum_euclidean, classification)
-                if len(neighbors) < self.k:
-                    heappush(neighbors, distance_and_class)
-                elif (-1 * distance_and_class.distance < neighbors[0].distance * -1):
-                    heappop(neighbors)
-                    heappush(neighbors, distance_and_class)
-
-        classifiers = {}
-        for neighbor in neighbors:
-            neighbor_class = neighbor.classification
-            try:
-                weighted_vote = 1.0 / neighbor.distance * -1
-            except(ZeroDivisionError) as error:
-                weighted_vote = 1.0
-            if neighbor_class in classifiers:
-                classifiers[neighbor_class] += weighted_vote
-            else:
-                classifiers[neighbor_class] = weighted_vote
-
-        largest_vote = max(classifiers.values())
-
-        if largest_vote < .0008:
-            classification = "unrecognized"
+        return self.vote_classification(self.item_votes(testing_item))
+
+    # Classifies a stack of N testing items at once. Returns the N classifications and an N x len(classes)
+    # matrix of weighted votes whose columns follow self.classes. The items are split into chunks so that
+    # at most about batch_element_limit distances or testing pixels are held in memory at a time.
+    def classify_many(self, testing_items, chunkSize = None):
+        testing_items = np.asarray(testing_items)
+        testing_matrix = self.testing_matrix(testing_items)
+
+        if self.index is not None:
+            votes = self.index_votes(testing_matrix)
         else:
-            classification = max(classifiers, key = classifiers.get)
-        
+            votes = self.scan_votes(testing_matrix, chunkSize)
 
-        return classification
+        classifications = [self.vote_classification(item_votes) for item_votes in votes]
+        return classifications, votes
+
+    # Testing items per chunk: the distance kernels measure the templates in their own bounded workspace, so a chunk
+    # holds one distance per template and the testing pixels of each of its items.
+    def default_chunk_size(self):
+        return max(1, self.batch_element_limit // max(1, len(self.training_labels), self.training_matrix.shape[1]))
+
+    # The k nearest templates to each of N testing items as an N x k record array of DISTANCE_AND_CLASS_DTYPE, nearest
+    # first, found by scanning every template in chunks as classify_many() does.
+    def neighbor_records(self, testing_items, chunkSize = None):
+        testing_matrix = self.testing_matrix(np.asarray(testing_items))
+        if chunkSize is None:
+            chunkSize = self.default_chunk_size()
+
+        records = np.empty((len(testing_matrix), min(self.k, len(self.training_labels))), dtype=DISTANCE_AND_CLASS_DTYPE)
+        for start in range(0, len(testing_matrix), chunkSize):
+            distances = self.batch_distances(testing_matrix[start:start + chunkSize])
+            neighbors = self.nearest_neighbors(distances)
+            neighbor_distances = np.take_along_axis(distances, neighbors, axis=1)
+
+            order = np.argsort(neighbor_distances, axis=1, kind='stable')
+            records[start:start + chunkSize] = distanceAndClassRecords(np.take_along_axis(neighbor_distances, order, axis=1),
+                                                                       np.take_along_axis(self.training_labels[neighbors], order, axis=1))
+        return records
+
+    # Fraction of the exact k nearest templates that are also found through the index, over the testing items.
+    def index_recall(self, testing_items):
+        if self.index is None:
+            return 1.0
+
+        found = 0
+        expected = 0
+        for testing_item in testing_items:
+            testing_matrix = self.testing_matrix(testing_item[np.newaxis])
+            exact = self.nearest_neighbors(self.batch_distances(testing_matrix))[0]
+
+            candidates = self.index.candidates(testing_matrix[0])
+            approximate = candidates[self.nearest_neighbors(self.batch_distances(testing_matrix, candidates))[0]]
+
+            found += len(np.intersect1d(exact, approximate))
+            expected += len(exact)
+
+        return found / expected if expected > 0 else 1.0
+
+    # Fraction of the testing items that the index classifies differently than a scan of every template does.
+    def index_verdict_changes(self, testing_items):
+        if self.index is None or len(testing_items) == 0:
+            return 0.0
+
+        testing_matrix = self.testing_matrix(np.asarray(testing_items))
+        indexed = [self.vote_classification(item_votes) for item_votes in self.index_votes(testing_matrix)]
+        scanned = [self.vote_classification(item_votes) for item_votes in self.scan_votes(testing_matrix)]
+        return sum(a != b for a, b in zip(indexed, scanned)) / len(testing_matrix)
 
     def euclidean_distance(self, source, target):
         if source is not None and target is not None:
-            distance = np.linalg.norm(source - target)
-            return distance
+            return Distance.euclideanDistance(source, target)
         else:
-            return 1
\ No newline at end of file
+            return 1
+
+# Stacks row matrices into one matrix. When the matrices lie back to back in the same buffer, as the classes of a
+# template pack do, the result is a read-only view of that buffer and nothing is copied.
+def joinRows(rowMatrices):
+    nonempty = [rows for rows in rowMatrices if len(rows) > 0]
+    if len(nonempty) == 0:
+        return np.concatenate(rowMatrices) if len(rowMatrices) > 0 else np.zeros((0, 0), dtype=np.uint8)
+
+    first = nonempty[0]
+    adjacent = True
+    address = first.__array_interface__['data'][0]
+    for rows in nonempty:
+        adjacent = adjacent and rows.flags.c_contiguous and rows.dtype == first.dtype and rows.shape[1] == first.shape[1]
+        adjacent = adjacent and rows.__array_interface__['data'][0] == address and rootBuffer(rows) is rootBuffer(first)
+        address += rows.nbytes
+
+    if not adjacent:
+        return np.concatenate(rowMatrices)
+
+    row_count = sum(len(rows) for rows in nonempty)
+    return np.lib.stride_tricks.as_strided(first, shape=(row_count, first.shape[1]), writeable=False)
+
+# The object that owns the memory an array views.
+def rootBuffer(array):
+    while isinstance(array, np.ndarray) and array.base is not None:
+        array = array.base
+    return array
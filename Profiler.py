@@ -0,0 +1,150 @@
+"""
+Profiler.py times the stages of frame processing, such as reading, filtering, background subtraction, edge detection
+and classification, and summarizes where the frame time goes.
+
+
+
+Copyright (c) 2020 Fall Detection System, All rights reserved.
+Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+
+1.	Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+
+2.	Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer
+    in the documentation and/or other materials provided with the distribution.
+
+3.	Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import csv
+import json
+import numpy as np
+from contextlib import nullcontext
+from timeit import default_timer as timer
+
+"""
+StageTimes holds the durations of the last windowSize runs of one stage in a ring buffer, for its rolling percentiles,
+along with the number of runs and the total time of every run.
+"""
+class StageTimes:
+
+    def __init__(self, name, windowSize = 1000):
+        self.name = name
+        self.durations = np.zeros(windowSize)
+        self.next_index = 0
+        self.runs = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds):
+        self.durations[self.next_index] = seconds
+        self.next_index = (self.next_index + 1) % len(self.durations)
+        self.runs += 1
+        self.total_seconds += seconds
+
+    # The durations of the runs in the rolling window, in no particular order.
+    def window(self):
+        return self.durations[:min(self.runs, len(self.durations))]
+
+    def percentile_ms(self, percentile):
+        window = self.window()
+        return 1000 * float(np.percentile(window, percentile)) if len(window) > 0 else 0.0
+
+    def mean_ms(self):
+        return 1000 * self.total_seconds / self.runs if self.runs > 0 else 0.0
+
+# Times one run of a stage from entering to leaving a with block.
+class StageTimer:
+
+    __slots__ = ('stage_times', 'start')
+
+    def __init__(self, stageTimes):
+        self.stage_times = stageTimes
+        self.start = None
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.stage_times.record(timer() - self.start)
+        return False
+
+"""
+Profiler times the stages of one stream, or of one run, by name. Each stage is timed with a with block around it:
+
+    with profiler.stage('mog2'):
+        foreground = backgroundSubtractor.apply(gray)
+
+A disabled Profiler returns one shared context that does nothing, so the instrumented code costs a method call per
+stage when profiling is off. DISABLED is the disabled Profiler used when no Profiler is given.
+"""
+class Profiler:
+
+    null_stage = nullcontext()
+
+    def __init__(self, name = '', enabled = True, windowSize = 1000):
+        self.name = name
+        self.enabled = enabled
+        self.window_size = windowSize
+        self.stages = {}
+
+    def stage(self, stageName):
+        if not self.enabled:
+            return self.null_stage
+        return StageTimer(self.stage_times(stageName))
+
+    # Records a run of a stage that was timed by the caller.
+    def record(self, stageName, seconds):
+        if self.enabled:
+            self.stage_times(stageName).record(seconds)
+
+    def stage_times(self, stageName):
+        stage_times = self.stages.get(stageName)
+        if stage_times is None:
+            stage_times = self.stages.setdefault(stageName, StageTimes(stageName, self.window_size))
+        return stage_times
+
+    # One row per stage, in the order the stages first ran. The percentiles are over the rolling window.
+    def summary(self):
+        rows = []
+        for stage_times in list(self.stages.values()):
+            rows.append({'profile': self.name,
+                         'stage': stage_times.name,
+                         'runs': stage_times.runs,
+                         'total_ms': round(1000 * stage_times.total_seconds, 3),
+                         'mean_ms': round(stage_times.mean_ms(), 3),
+                         'p50_ms': round(stage_times.percentile_ms(50), 3),
+                         'p95_ms': round(stage_times.percentile_ms(95), 3),
+                         'p99_ms': round(stage_times.percentile_ms(99), 3)})
+        return rows
+
+DISABLED = Profiler('disabled', enabled=False)
+
+SUMMARY_FIELDS = ['profile', 'stage', 'runs', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms']
+
+# Writes summary rows to a .csv file, or to a JSON list of rows for any other file name.
+def exportSummary(rows, path):
+    try:
+        with open(path, 'w', newline='') as summary_file:
+            if path.lower().endswith('.csv'):
+                writer = csv.DictWriter(summary_file, fieldnames=SUMMARY_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                json.dump(rows, summary_file, indent=2)
+    except OSError as error:
+        print(error)
+
+def printSummary(rows):
+    print(f"{'profile':<32}{'stage':<20}{'runs':>7}{'total ms':>11}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for row in rows:
+        print(f"{row['profile'][-32:]:<32}{row['stage']:<20}{row['runs']:>7}{row['total_ms']:>11.1f}{row['mean_ms']:>9.2f}"
+              f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}")
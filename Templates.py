@@ -23,13 +23,213 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
 POSSIBILITY OF SUCH DAMAGE.
 
 """
+import argparse
+import hashlib
+import json
 import psycopg2
 import numpy as np
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError
 from cv2 import cv2
-from os import walk
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from glob import escape as glob_escape, glob
+from os import cpu_count, path, replace, stat, walk
+from time import sleep
+from timeit import default_timer as timer
+import threading
 
 import ComputerVision
+import Distance
 
+TEMPLATE_DIRECTORY = "./templates/cropped_templates"
+TEMPLATE_PACK_PATH = "./templates/template_pack.fdsp"
+TEMPLATE_CHARACTERISTICS = ["edge", "foreground"]
+TEMPLATE_TYPES = ["upright", "falling", "sitting", "lying"]
+
+# Threads used to decode template images. cv2.imdecode releases the GIL, so decoding scales with the cores.
+DECODE_WORKERS = cpu_count() or 1
+
+"""
+LoadMetrics records how long one load of templates took. Every load appends its metrics to load_metrics and prints
+them, so the effect of the number of decode workers can be seen.
+"""
+class LoadMetrics:
+    def __init__(self, source, templateCount, byteCount, seconds, workers):
+        self.source = source
+        self.template_count = templateCount
+        self.byte_count = byteCount
+        self.seconds = seconds
+        self.workers = workers
+
+    def templates_per_second(self):
+        return self.template_count / self.seconds if self.seconds > 0 else float('inf')
+
+    def __str__(self):
+        return (f"Loaded {self.template_count} templates ({self.byte_count / 1e6:.1f} MB) from {self.source} "
+                f"in {self.seconds:.3f} s with {self.workers} workers ({self.templates_per_second():.0f} templates/s).")
+
+load_metrics = []
+
+def recordLoadMetrics(source, templateCount, byteCount, seconds, workers):
+    metrics = LoadMetrics(source, templateCount, byteCount, seconds, workers)
+    load_metrics.append(metrics)
+    print(metrics)
+    return metrics
+
+# Applies a decoding function to every item on a pool of worker threads, keeping the order of the items.
+def decodeInParallel(decode, items, workers = None):
+    if workers is None:
+        workers = DECODE_WORKERS
+
+    if workers <= 1 or len(items) <= 1:
+        return [decode(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(decode, items))
+
+def decodeImageFile(filePath):
+    return ComputerVision.byteStringToImage(ComputerVision.imagePathToByteString(filePath))
+
+
+"""
+ConnectionPool shares a bounded number of PostgreSQL connections between the threads that use a TemplateDatabase, so
+several camera workers can load and refresh templates at once instead of queueing on one socket. A connection that
+has been idle for healthCheckInterval seconds is checked with SELECT 1 before it is handed out, broken connections
+are dropped, and new connections are opened with exponential backoff between failed attempts. connectionFactory
+is any callable returning a DB-API connection, which lets a stand-in replace PostgreSQL.
+"""
+class ConnectionPool:
+    def __init__(self, connectionFactory, maxConnections = 4, healthCheckInterval = 30.0,
+                 connectRetries = 3, backoffBase = 0.25, backoffMax = 4.0, acquireTimeout = None):
+        self.connection_factory = connectionFactory
+        self.max_connections = maxConnections
+        self.health_check_interval = healthCheckInterval
+        self.connect_retries = connectRetries
+        self.backoff_base = backoffBase
+        self.backoff_max = backoffMax
+        self.acquire_timeout = acquireTimeout
+
+        # Idle connections with the time they were returned, and the number of connections handed out or idle.
+        self.idle = []
+        self.open_count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    # Hands out an idle connection, or opens a new one while fewer than max_connections are open,
+    # otherwise waits for one to be released.
+    def acquire(self):
+        deadline = None if self.acquire_timeout is None else timer() + self.acquire_timeout
+        connection = None
+
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise PoolError("The connection pool is closed.")
+                if len(self.idle) > 0:
+                    connection, last_used = self.idle.pop()
+                    break
+                if self.open_count < self.max_connections:
+                    self.open_count += 1
+                    break
+
+                remaining = None if deadline is None else deadline - timer()
+                if remaining is not None and remaining <= 0:
+                    raise PoolError("Timed out waiting for a database connection.")
+                self.condition.wait(remaining)
+
+        if connection is not None:
+            if self.healthy(connection, last_used):
+                return connection
+            closeQuietly(connection)
+
+        try:
+            return self.open_connection()
+        except Exception:
+            self.forget_connection()
+            raise
+
+    def release(self, connection):
+        if connection.closed:
+            self.forget_connection()
+            return
+
+        try:
+            # Ends any transaction the user of the connection left open.
+            connection.rollback()
+        except (Exception, psycopg2.DatabaseError):
+            closeQuietly(connection)
+            self.forget_connection()
+            return
+
+        with self.condition:
+            if self.closed:
+                closeQuietly(connection)
+                self.open_count -= 1
+            else:
+                self.idle.append((connection, timer()))
+            self.condition.notify()
+
+    # Borrows a connection for the body of a with statement.
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            closeQuietly(connection)
+            raise
+        finally:
+            self.release(connection)
+
+    def healthy(self, connection, lastUsed):
+        if connection.closed:
+            return False
+        if timer() - lastUsed < self.health_check_interval:
+            return True
+
+        try:
+            curr = connection.cursor()
+            curr.execute('SELECT 1')
+            curr.fetchone()
+            curr.close()
+            connection.rollback()
+            return True
+        except (Exception, psycopg2.DatabaseError):
+            return False
+
+    # Opens a connection, retrying failed attempts after delays that double up to backoff_max.
+    def open_connection(self):
+        delay = self.backoff_base
+        for attempt in range(self.connect_retries + 1):
+            try:
+                return self.connection_factory()
+            except psycopg2.OperationalError as error:
+                if attempt == self.connect_retries:
+                    raise
+                print(f"Connection attempt failed, retrying in {delay:.2f} s: {error}")
+                sleep(delay)
+                delay = min(delay * 2, self.backoff_max)
+
+    def forget_connection(self):
+        with self.condition:
+            self.open_count -= 1
+            self.condition.notify()
+
+    def close_all(self):
+        with self.condition:
+            self.closed = True
+            for connection, _ in self.idle:
+                closeQuietly(connection)
+                self.open_count -= 1
+            self.idle = []
+            self.condition.notify_all()
+
+def closeQuietly(connection):
+    try:
+        connection.close()
+    except (Exception, psycopg2.DatabaseError):
+        pass
 
 """
 TemplateDatabase referenced and defined in section 2.0 of the SDD, A03_SDD_Team4.docx. 
@@ -42,49 +242,74 @@ is addressed in the TemplateDatabase class, specifically the access_images() met
 """
 # Database class to handle pgfunctionality
 class TemplateDatabase:
-    conn = None
+    pool = None
     
     template_types = ['upright', 'falling', 'sitting', 'lying']
     template_characteristics = ['edge', 'foreground']
     template_dictionary = {'edge': {}, 'foreground': {}}
 
-    def __init__(self, databaseName, databasePassword):
+    # poolSize bounds the number of connections shared by the threads using this database. connectionFactory
+    # replaces the default psycopg2 connection to localhost, for example with a stand-in for testing.
+    def __init__(self, databaseName, databasePassword, decodeWorkers = None, poolSize = 4, connectionFactory = None):
         self.database_name = databaseName
         self.database_password = databasePassword
+        self.decode_workers = decodeWorkers if decodeWorkers is not None else DECODE_WORKERS
+        self.pool_size = poolSize
+        self.connection_factory = connectionFactory if connectionFactory is not None else self.open_connection
     
     # TemplateDatabase methods
     def connected(self):
-        if self.conn is not None:
+        if self.pool is not None:
             return True
         else:
             return False
 
+    def open_connection(self):
+        return psycopg2.connect(host = 'localhost', \
+            database = self.database_name, user = 'postgres', \
+            password = self.database_password)
+
+    # Borrows a pooled connection for the body of a with statement.
+    def connection(self):
+        if self.pool is None:
+            raise psycopg2.InterfaceError("Not connected to the database.")
+        return self.pool.connection()
+
+    # Creates the connection pool and checks that a connection can be made. Calling it again while connected
+    # only checks the existing pool.
     def connect(self):
+        created_pool = self.pool is None
         try:
             # Attempts to connect to server
             print("Connecting...")
-            self.conn = psycopg2.connect(host = 'localhost', \
-                database = self.database_name, user = 'postgres', \
-                password = self.database_password)
+            if created_pool:
+                self.pool = ConnectionPool(self.connection_factory, maxConnections=self.pool_size)
+            with self.connection():
+                pass
             print("Connection successful.")
             self.print_db_version()  
         except (Exception, psycopg2.DatabaseError) as error:
             print(error)
+            if created_pool and self.pool is not None:
+                self.pool.close_all()
+                self.pool = None
       
     def disconnect(self):
         # Closes communcation with PostgreSQL server
         print("Disconnecting...")
-        if self.conn is not None:
-            self.conn.close()
+        if self.pool is not None:
+            self.pool.close_all()
+            self.pool = None
         print("Disconnection successful.")
 
     def print_db_version(self):
         print('PostgreSQL database version:')
         try:
-            curr = self.conn.cursor()
-            curr.execute('SELECT version()')
-            db_version = curr.fetchone()
-            curr.close()
+            with self.connection() as conn:
+                curr = conn.cursor()
+                curr.execute('SELECT version()')
+                db_version = curr.fetchone()
+                curr.close()
             print(db_version)
         except (Exception, psycopg2.DatabaseError) as error:
             print(error)
@@ -92,29 +317,30 @@ class TemplateDatabase:
     # Allows the user to add templates to the database.
     def add_template(self, templateType, templateCharateristic, imageName, imageByteArray):
         try:
-            curr = self.conn.cursor()
-            print("adding template...")
-            curr.execute('''
-            INSERT INTO template (template_type, template_characteristic, image_name, image)
-            VALUES(%s, %s, %s, %s)''', (templateType, templateCharateristic, imageName, imageByteArray))
-            print("Updating template table...")
-            self.conn.commit()
-            curr.close()
+            with self.connection() as conn:
+                curr = conn.cursor()
+                print("adding template...")
+                curr.execute('''
+                INSERT INTO template (template_type, template_characteristic, image_name, image)
+                VALUES(%s, %s, %s, %s)''', (templateType, templateCharateristic, imageName, imageByteArray))
+                print("Updating template table...")
+                conn.commit()
+                curr.close()
             print("Added template successfully.")
         except (Exception, psycopg2.DatabaseError) as error:
             print(error)
-        curr.close()
     
     # Allows the user to remove templates from the database.
     def delete_template(self, templateId):
         try:
-            curr = self.conn.cursor()
-            curr.execute('''
-            DELETE FROM template
-            WHERE template_id = %s
-            ''', (templateId,))
-            self.conn.commit()
-            curr.close()
+            with self.connection() as conn:
+                curr = conn.cursor()
+                curr.execute('''
+                DELETE FROM template
+                WHERE template_id = %s
+                ''', (templateId,))
+                conn.commit()
+                curr.close()
             print("Deleted template successfully.")
         except (Exception, psycopg2.DatabaseError) as error:
             print(error)
@@ -122,15 +348,16 @@ class TemplateDatabase:
     # Find a template by id in the database.
     def access_image_by_id(self, templateId):
         try:
-            curr = self.conn.cursor()
-            curr.execute('''
-            SELECT image
-            FROM template
-            WHERE template_id = %s
-            ''', (templateId,))
-            template_bytes = curr.fetchone()
+            with self.connection() as conn:
+                curr = conn.cursor()
+                curr.execute('''
+                SELECT image
+                FROM template
+                WHERE template_id = %s
+                ''', (templateId,))
+                template_bytes = curr.fetchone()
+                curr.close()
             template = ComputerVision.byteStringToImage(template_bytes[0].tobytes())
-            curr.close()
             return template
         except (Exception, psycopg2.DatabaseError) as error:
             print(error)
@@ -138,20 +365,22 @@ class TemplateDatabase:
     # Allows the user to access all images.   
     def access_images(self, templateType, templateCharacteristic):
         try:
-            curr = self.conn.cursor()
-            curr.execute('''
-            SELECT template_id, image
-            FROM template
-            WHERE (template_type = %s) AND (template_characteristic = %s)
-            ''', (templateType, templateCharacteristic))
-            rows = curr.fetchall()
-            template_type_array = []
-            for row in rows:
-                template_bytes = row[1].tobytes()
-                template = ComputerVision.byteStringToImage(template_bytes)
-                template_type_array.append(template)
-                
-            curr.close()
+            with self.connection() as conn:
+                curr = conn.cursor()
+                curr.execute('''
+                SELECT template_id, image
+                FROM template
+                WHERE (template_type = %s) AND (template_characteristic = %s)
+                ''', (templateType, templateCharacteristic))
+                start = timer()
+                rows = curr.fetchall()
+                curr.close()
+
+            template_bytes = [row[1].tobytes() for row in rows]
+            template_type_array = decodeInParallel(ComputerVision.byteStringToImage, template_bytes, self.decode_workers)
+
+            recordLoadMetrics(f"the {templateCharacteristic} {templateType} table rows", len(template_type_array),
+                              sum(len(image_bytes) for image_bytes in template_bytes), timer() - start, self.decode_workers)
             print(f"Successfully loaded {templateCharacteristic} {templateType} array.")
             return template_type_array
         except (Exception, psycopg2.DatabaseError) as error:
@@ -160,58 +389,467 @@ class TemplateDatabase:
     # Returns a list of all available ids.
     def list_of_all_IDs(self):
         try:
-            curr = self.conn.cursor()
-            curr.execute('''
-            SELECT template_id
-            FROM template
-            ''', )
-            rows = curr.fetchall()
+            with self.connection() as conn:
+                curr = conn.cursor()
+                curr.execute('''
+                SELECT template_id
+                FROM template
+                ''', )
+                rows = curr.fetchall()
+                curr.close()
             id_list = []
             for row in rows:
                 id_list.append(str(row[0]))
-            curr.close()
             return id_list
         except (Exception, psycopg2.DatabaseError) as error:
             print(error)
 
-    # Loads the templates from the database.
-    def load_templates(self, templates):
-        for template_characteristic in templates.keys():
-            for template_type in templates[template_characteristic].keys():
+    # Loads the templates from the database with one ordered query. The rows stay on the server behind a named
+    # cursor and are fetched and decoded batchSize at a time, so only about one batch of image bytes is held in
+    # memory on top of the decoded templates.
+    def load_templates(self, templates, batchSize = 256):
+        start = timer()
+        template_count = 0
+        byte_count = 0
+
+        loaded_templates = {template_characteristic: {template_type: [] for template_type in templates[template_characteristic]}
+                            for template_characteristic in templates}
+        characteristics = list(loaded_templates.keys())
+        types = sorted(set(template_type for type_templates in loaded_templates.values() for template_type in type_templates))
 
-                templates[template_characteristic][template_type] = \
-                    self.access_images(templateType=template_type, templateCharacteristic=template_characteristic)
-                    
+        try:
+            with self.connection() as conn:
+                curr = conn.cursor(name='load_templates')
+                curr.itersize = batchSize
+                curr.execute('''
+                SELECT template_characteristic, template_type, image
+                FROM template
+                WHERE (template_characteristic = ANY(%s)) AND (template_type = ANY(%s))
+                ORDER BY template_characteristic, template_type, template_id
+                ''', (characteristics, types))
+
+                while True:
+                    rows = curr.fetchmany(batchSize)
+                    if len(rows) == 0:
+                        break
+
+                    template_bytes = [row[2].tobytes() for row in rows]
+                    images = decodeInParallel(ComputerVision.byteStringToImage, template_bytes, self.decode_workers)
+                    for (template_characteristic, template_type, _), image in zip(rows, images):
+                        if template_type in loaded_templates[template_characteristic]:
+                            loaded_templates[template_characteristic][template_type].append(image)
+
+                    template_count += len(rows)
+                    byte_count += sum(len(image_bytes) for image_bytes in template_bytes)
+
+                curr.close()
+                # A named cursor only lives inside a transaction, which is ended here.
+                conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(error)
+            return templates
+
+        for template_characteristic, type_templates in loaded_templates.items():
+            for template_type, images in type_templates.items():
+                templates[template_characteristic][template_type] = images
+
+        recordLoadMetrics("the template table", template_count, byte_count, timer() - start, self.decode_workers)
         return templates
 
+    # Finds how the template table differs from the template_ids already loaded. Returns the (template_id,
+    # template_characteristic, template_type, image) rows added since, decoded batchSize at a time, and the
+    # set of loaded template_ids no longer in the table, or None if the table could not be read.
+    def template_changes(self, knownIds, templateCharacteristics, templateTypes, batchSize = 256):
+        start = timer()
+        added_rows = []
+        byte_count = 0
+
+        try:
+            with self.connection() as conn:
+                curr = conn.cursor()
+                curr.execute('''
+                SELECT template_id
+                FROM template
+                WHERE (template_characteristic = ANY(%s)) AND (template_type = ANY(%s))
+                ''', (list(templateCharacteristics), list(templateTypes)))
+                current_ids = set(row[0] for row in curr.fetchall())
+                curr.close()
+
+                added_ids = sorted(current_ids - knownIds)
+                removed_ids = knownIds - current_ids
+
+                if len(added_ids) > 0:
+                    curr = conn.cursor(name='template_changes')
+                    curr.itersize = batchSize
+                    curr.execute('''
+                    SELECT template_id, template_characteristic, template_type, image
+                    FROM template
+                    WHERE template_id = ANY(%s)
+                    ORDER BY template_id
+                    ''', (added_ids,))
+
+                    while True:
+                        rows = curr.fetchmany(batchSize)
+                        if len(rows) == 0:
+                            break
+
+                        template_bytes = [row[3].tobytes() for row in rows]
+                        images = decodeInParallel(ComputerVision.byteStringToImage, template_bytes, self.decode_workers)
+                        added_rows.extend((row[0], row[1], row[2], image) for row, image in zip(rows, images))
+                        byte_count += sum(len(image_bytes) for image_bytes in template_bytes)
+
+                    curr.close()
+                conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(error)
+            return None
+
+        if len(added_rows) > 0:
+            recordLoadMetrics("new template table rows", len(added_rows), byte_count, timer() - start, self.decode_workers)
+        return added_rows, removed_ids
+
+    # Uploads many templates in a single transaction. templateFiles lists (templateType, templateCharacteristic, filePath)
+    # entries; files are read and inserted batchSize at a time with one multi-row INSERT per batch. A file is skipped
+    # when a template with the same image_name and the same content (md5) is already in the table.
+    def bulk_add_templates(self, templateFiles, batchSize = 500):
+        start = timer()
+        inserted_count = 0
+        skipped_count = 0
+
+        try:
+            with self.connection() as conn:
+                curr = conn.cursor()
+                curr.execute('''
+                SELECT image_name, md5(image)
+                FROM template
+                ''')
+                existing = set(curr.fetchall())
+
+                for batch_start in range(0, len(templateFiles), batchSize):
+                    rows = []
+                    for template_type, template_characteristic, file_path in templateFiles[batch_start:batch_start + batchSize]:
+                        image_name = path.basename(file_path)
+                        image = ComputerVision.imagePathToByteString(file_path)
+                        key = (image_name, hashlib.md5(image).hexdigest())
+                        if key in existing:
+                            skipped_count += 1
+                            continue
+                        existing.add(key)
+                        rows.append((template_type, template_characteristic, image_name, psycopg2.Binary(image)))
+
+                    if len(rows) == 0:
+                        continue
+
+                    # Images are unique in the table, so the same image under another name is skipped as well.
+                    inserted = execute_values(curr, '''
+                    INSERT INTO template (template_type, template_characteristic, image_name, image)
+                    VALUES %s
+                    ON CONFLICT (image) DO NOTHING
+                    RETURNING template_id
+                    ''', rows, page_size=batchSize, fetch=True)
+                    inserted_count += len(inserted)
+                    skipped_count += len(rows) - len(inserted)
+
+                conn.commit()
+                curr.close()
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(error)
+            return 0
+
+        seconds = timer() - start
+        rows_per_second = inserted_count / seconds if seconds > 0 else float('inf')
+        print(f"Uploaded {inserted_count} templates and skipped {skipped_count} already present "
+              f"in {seconds:.2f} s ({rows_per_second:.0f} rows/s).")
+        return inserted_count
+
     # Mass uploads all the local templates.
-    def upload_all_local_templates(self):
+    def upload_all_local_templates(self, templateDirectory = TEMPLATE_DIRECTORY, batchSize = 500):
+        template_files = []
+        for template_characteristic, type_paths in templateImagePaths(templateDirectory).items():
+            for template_type, paths in type_paths.items():
+                template_files.extend((template_type, template_characteristic, file_path) for file_path in paths)
+
+        return self.bulk_add_templates(template_files, batchSize)
+
+    # Uploads the frames a display() session saved as templates, all as the given template type. The session's
+    # frames are saved as <sessionName>_<frame>.png in each characteristic's folder.
+    def upload_session_templates(self, sessionName, templateType, templateDirectory = TEMPLATE_DIRECTORY, batchSize = 500):
+        template_files = []
         for template_characteristic in self.template_characteristics:
-            for template_type in self.template_types:
-                path = f"./templates/cropped_templates/{template_characteristic}/{template_type}/"
-                for (_, _, filenames) in walk(path):
-                    for filename in filenames:
-                        file_path = f"{path}{filename}"
-                        image = ComputerVision.imagePathToByteArray(file_path)
-                        self.add_template(template_type, template_characteristic, filename, image)
+            session_paths = sorted(glob(f"{templateDirectory}/{template_characteristic}/{glob_escape(sessionName)}_*.png"))
+            template_files.extend((templateType, template_characteristic, file_path) for file_path in session_paths)
+
+        return self.bulk_add_templates(template_files, batchSize)
+
+"""
+TemplateSync keeps a templates dictionary, and the KNeighborsClassifiers built from it, in step with the template
+table. Each refresh() asks the database only for the template_ids that changed since the last one, fetches and
+decodes just the added rows, and adds or removes those templates in the classifiers' packed matrices, so leaving
+the database menu no longer reloads every template. The template_ids already loaded are the watermark: the table
+has no updated_at column, and serial ids are not guaranteed to commit in order, so a max template_id alone could
+miss rows.
+"""
+class TemplateSync:
+    def __init__(self, database, templates, batchSize = 256):
+        self.database = database
+        self.templates = templates
+        self.batch_size = batchSize
+
+        # template_ids of the images in each templates list, in the same order. Images that did not come from
+        # the table, such as locally loaded ones, have the id -1 and are never removed.
+        self.template_ids = {template_characteristic: {template_type: [-1] * len(images) for template_type, images in type_templates.items()}
+                             for template_characteristic, type_templates in templates.items()}
+        self.classifiers = {template_characteristic: [] for template_characteristic in templates}
+
+    # Updates the classifier along with the templates of the given characteristic. The classifier must have
+    # been built from the current templates of that characteristic.
+    def track(self, templateCharacteristic, classifier):
+        classifier.set_template_ids(self.template_ids[templateCharacteristic])
+        self.classifiers[templateCharacteristic].append(classifier)
+
+    def known_ids(self):
+        return set(template_id for type_ids in self.template_ids.values() for ids in type_ids.values()
+                   for template_id in ids if template_id >= 0)
+
+    # Applies the changes in the template table. Returns the number of templates added and removed, or None
+    # when the table could not be read, in which case nothing is changed.
+    def refresh(self):
+        template_types = set(template_type for type_templates in self.templates.values() for template_type in type_templates)
+        changes = self.database.template_changes(self.known_ids(), self.templates.keys(), template_types, self.batch_size)
+        if changes is None:
+            return None
+        added_rows, removed_ids = changes
+
+        if len(removed_ids) > 0:
+            self.remove_templates(removed_ids)
+        if len(added_rows) > 0:
+            self.add_templates(added_rows)
+
+        print(f"Template sync added {len(added_rows)} and removed {len(removed_ids)} templates.")
+        return len(added_rows), len(removed_ids)
+
+    def remove_templates(self, removedIds):
+        for template_characteristic, type_ids in self.template_ids.items():
+            for template_type, ids in type_ids.items():
+                keep = [template_id not in removedIds for template_id in ids]
+                if all(keep):
+                    continue
+
+                images = self.templates[template_characteristic][template_type]
+                self.templates[template_characteristic][template_type] = [image for image, kept in zip(images, keep) if kept]
+                type_ids[template_type] = [template_id for template_id, kept in zip(ids, keep) if kept]
+
+            for classifier in self.classifiers[template_characteristic]:
+                classifier.remove_templates(removedIds)
+
+    def add_templates(self, addedRows):
+        added = {template_characteristic: {} for template_characteristic in self.templates}
+        for template_id, template_characteristic, template_type, image in addedRows:
+            added[template_characteristic].setdefault(template_type, []).append((template_id, image))
+
+        for template_characteristic, type_rows in added.items():
+            for template_type, rows in type_rows.items():
+                ids = [template_id for template_id, _ in rows]
+                images = [image for _, image in rows]
+
+                # Template packs load as arrays, which are turned into lists so that templates can be appended.
+                self.templates[template_characteristic][template_type] = list(self.templates[template_characteristic].get(template_type, [])) + images
+                self.template_ids[template_characteristic].setdefault(template_type, []).extend(ids)
+
+                for classifier in self.classifiers[template_characteristic]:
+                    classifier.add_templates(template_type, images, ids)
+
+# Lists the template images of every characteristic and type, in the order the templates are loaded.
+def templateImagePaths(templateDirectory = TEMPLATE_DIRECTORY):
+    image_paths = {template_characteristic: {} for template_characteristic in TEMPLATE_CHARACTERISTICS}
+
+    for template_characteristic in TEMPLATE_CHARACTERISTICS:
+        for template_type in TEMPLATE_TYPES:
+            directory = f"{templateDirectory}/{template_characteristic}/{template_type}/"
+            for (_, _, filenames) in walk(directory):
+                image_paths[template_characteristic][template_type] = [f"{directory}{filename}" for filename in filenames]
+
+    return image_paths
+
+# Identifies the template images by name, size and modification time, so a pack can tell when it is out of date.
+def sourceFingerprint(imagePaths):
+    fingerprint = hashlib.sha1()
+    for template_characteristic, type_paths in imagePaths.items():
+        for template_type, paths in type_paths.items():
+            fingerprint.update(f"{template_characteristic}/{template_type}:{len(paths)}\n".encode())
+            for file_path in paths:
+                file_stat = stat(file_path)
+                fingerprint.update(f"{file_path}:{file_stat.st_size}:{file_stat.st_mtime_ns}\n".encode())
+    return fingerprint.hexdigest()
+
+# Decodes the template images into the nested templates dictionary, keeping the order of each type's images.
+def loadTemplateImages(imagePaths, workers = None):
+    if workers is None:
+        workers = DECODE_WORKERS
+
+    start = timer()
+    file_paths = [file_path for type_paths in imagePaths.values() for paths in type_paths.values() for file_path in paths]
+    decoded_images = iter(decodeInParallel(decodeImageFile, file_paths, workers))
+
+    templates = {template_characteristic: {} for template_characteristic in imagePaths}
+    for template_characteristic, type_paths in imagePaths.items():
+        for template_type, paths in type_paths.items():
+            templates[template_characteristic][template_type] = [next(decoded_images) for _ in paths]
+
+    byte_count = sum(stat(file_path).st_size for file_path in file_paths)
+    recordLoadMetrics("template images", len(file_paths), byte_count, timer() - start, workers)
+    return templates
+
+"""
+A template pack holds every local template in one file so that they can be memory-mapped at startup instead of
+decoding each PNG. The file starts with TEMPLATE_PACK_MAGIC, the length of a JSON header and the header itself,
+which gives the shape and dtype of the image data, the [start, stop) rows of each characteristic and type, the
+fingerprint of the source images and a sha256 hash of the image data. The image data follows at the next multiple
+of 64 bytes as one C-ordered array, with the rows of each characteristic's types stored next to each other.
+A bit-packed pack has the 'bits' encoding in its header, with the image shape and threshold, and holds one row of
+Distance.packedWidth() bytes per template instead of its image.
+"""
+TEMPLATE_PACK_MAGIC = b'FDSPACK1'
+TEMPLATE_PACK_ALIGNMENT = 64
+
+# Decodes the local template images and writes them into a template pack. With binary set, the images are
+# thresholded and bit-packed.
+def compileTemplatePack(packPath = TEMPLATE_PACK_PATH, templateDirectory = TEMPLATE_DIRECTORY, workers = None, binary = False):
+    image_paths = templateImagePaths(templateDirectory)
+    templates = loadTemplateImages(image_paths, workers)
+
+    images = []
+    index = []
+    for template_characteristic, type_templates in templates.items():
+        for template_type, type_images in type_templates.items():
+            index.append([template_characteristic, template_type, len(images), len(images) + len(type_images)])
+            images.extend(type_images)
+
+    if any(image is None for image in images):
+        raise ValueError("A template image could not be decoded.")
+    if len(set((image.shape, image.dtype.str) for image in images)) > 1:
+        raise ValueError("Template images must all have the same shape and dtype to be packed.")
+
+    data = np.stack(images) if len(images) > 0 else np.zeros((0,) + Distance.TEMPLATE_SHAPE, dtype=np.uint8)
+    header = {'index': index, 'source_fingerprint': sourceFingerprint(image_paths)}
+    if binary:
+        header['encoding'] = 'bits'
+        header['image_shape'] = list(data.shape[1:])
+        header['threshold'] = Distance.BINARY_THRESHOLD
+        data = Distance.packBits(data)
+    header['shape'] = list(data.shape)
+    header['dtype'] = data.dtype.str
+    header['content_hash'] = hashlib.sha256(data.tobytes()).hexdigest()
+    header = json.dumps(header).encode()
+
+    header_end = len(TEMPLATE_PACK_MAGIC) + 4 + len(header)
+    padding = b' ' * (-header_end % TEMPLATE_PACK_ALIGNMENT)
+
+    # Written beside the pack and renamed over it, so a reader never maps a half-written file.
+    temporary_path = f"{packPath}.tmp"
+    with open(temporary_path, 'wb') as f:
+        f.write(TEMPLATE_PACK_MAGIC)
+        f.write(len(header + padding).to_bytes(4, 'little'))
+        f.write(header + padding)
+        f.write(data.tobytes())
+    replace(temporary_path, packPath)
+
+    print(f"Packed {len(images)} templates into {packPath}.")
+    return packPath
+
+# Reads the header of a template pack, or returns None when the file is missing or is not a template pack.
+def readTemplatePackHeader(packPath):
+    if not path.exists(packPath):
+        return None
+
+    with open(packPath, 'rb') as f:
+        if f.read(len(TEMPLATE_PACK_MAGIC)) != TEMPLATE_PACK_MAGIC:
+            return None
+        header_length = int.from_bytes(f.read(4), 'little')
+        header = json.loads(f.read(header_length))
+
+    header['data_offset'] = len(TEMPLATE_PACK_MAGIC) + 4 + header_length
+    return header
+
+# Memory-maps a template pack into the nested templates dictionary. Each type holds a read-only
+# (count, height, width) view into the mapped file, so no template data is copied. The types of a bit-packed
+# pack hold Distance.BinaryTemplates over views of their packed rows.
+def openTemplatePack(packPath = TEMPLATE_PACK_PATH, header = None):
+    if header is None:
+        header = readTemplatePackHeader(packPath)
+
+    data = np.memmap(packPath, dtype=np.dtype(header['dtype']), mode='r',
+                     offset=header['data_offset'], shape=tuple(header['shape']))
+
+    templates = {}
+    for template_characteristic, template_type, start, stop in header['index']:
+        if header.get('encoding') == 'bits':
+            type_templates = Distance.BinaryTemplates(data[start:stop], header['image_shape'], header['threshold'])
+        else:
+            type_templates = data[start:stop]
+        templates.setdefault(template_characteristic, {})[template_type] = type_templates
+
+    return templates
+
+# Path of the bit-packed pack kept beside the template pack at packPath.
+def binaryPackPath(packPath = TEMPLATE_PACK_PATH):
+    return f"{packPath}.bits"
+
+# Thresholds and bit-packs the images of every type of a templates dictionary into Distance.BinaryTemplates.
+def binarizeTemplates(templates, threshold = Distance.BINARY_THRESHOLD):
+    return {template_characteristic: {template_type: Distance.binaryTemplates(images, threshold)
+                                      for template_type, images in type_templates.items()}
+            for template_characteristic, type_templates in templates.items()}
+
+# Checks the content hash of a template pack against its image data.
+def verifyTemplatePack(packPath = TEMPLATE_PACK_PATH):
+    header = readTemplatePackHeader(packPath)
+    if header is None:
+        return False
+
+    data = np.memmap(packPath, dtype=np.dtype(header['dtype']), mode='r',
+                     offset=header['data_offset'], shape=tuple(header['shape']))
+    return hashlib.sha256(data.tobytes()).hexdigest() == header['content_hash']
 
 # Loads templates from files saved on local machine. (NOTE: Folders must be premade and organized to use)
-def loadTemplatesLocally():
-    local_templates = {"edge": {}, "foreground": {}}
+# The templates are memory-mapped from the template pack, which is rebuilt first if the images have changed
+# since it was compiled. With usePack=False every image is decoded instead, on workers threads. With binary set,
+# every type holds Distance.BinaryTemplates, mapped from the bit-packed pack kept beside the template pack.
+def loadTemplatesLocally(usePack = True, packPath = TEMPLATE_PACK_PATH, templateDirectory = TEMPLATE_DIRECTORY, workers = None,
+                         binary = False):
+    image_paths = templateImagePaths(templateDirectory)
 
-    template_characteristics = ["edge", "foreground"]
-    template_types = ["upright", "falling", "sitting", "lying"]
-    
-    for template_characteristic in template_characteristics:
-        for template_type in template_types:
-            path = f"./templates/cropped_templates/{template_characteristic}/{template_type}/"
-            for (_, _, filenames) in walk(path):
-                images = []
-                for filename in filenames:
-                    file_path = f"{path}{filename}"
-                    byte_str = ComputerVision.imagePathToByteString(file_path)
-                    image = ComputerVision.byteStringToImage(byte_str)
-                    images.append(image)
-                local_templates[template_characteristic][template_type] = images
-
-    return local_templates
+    if not usePack:
+        templates = loadTemplateImages(image_paths, workers)
+        return binarizeTemplates(templates) if binary else templates
+
+    if binary:
+        packPath = binaryPackPath(packPath)
+    header = readTemplatePackHeader(packPath)
+    if (header is None or header['source_fingerprint'] != sourceFingerprint(image_paths)
+            or (header.get('encoding') == 'bits') != binary):
+        print("Template pack is missing or out of date, rebuilding...")
+        compileTemplatePack(packPath, templateDirectory, workers, binary)
+        header = None
+
+    return openTemplatePack(packPath, header)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fall Detection System templates.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = subparsers.add_parser('pack', help='Compile the local template images into a template pack.')
+    pack_parser.add_argument('--output', default=TEMPLATE_PACK_PATH)
+    pack_parser.add_argument('--templates', default=TEMPLATE_DIRECTORY)
+    pack_parser.add_argument('--workers', type=int, default=DECODE_WORKERS)
+    pack_parser.add_argument('--binary', action='store_true', help='Threshold and bit-pack the templates.')
+
+    verify_parser = subparsers.add_parser('verify', help='Check the content hash of a template pack.')
+    verify_parser.add_argument('--pack', default=TEMPLATE_PACK_PATH)
+
+    arguments = parser.parse_args()
+
+    if arguments.command == 'pack':
+        compileTemplatePack(arguments.output, arguments.templates, arguments.workers, arguments.binary)
+    elif arguments.command == 'verify':
+        print("Template pack is intact." if verifyTemplatePack(arguments.pack) else "Template pack is missing or corrupt.")
@@ -29,7 +29,7 @@ import Templates
 
 
 # Creates the user interface in the console.
-def systemUserInterface(templates, database, foregroundClassifier, edgeClassifier):
+def systemUserInterface(templates, database, foregroundClassifier, edgeClassifier, templateSync = None):
 
     while True:
 
@@ -70,11 +70,16 @@ def systemUserInterface(templates, database, foregroundClassifier, edgeClassifie
                     check_templates = input()
                     check_templates = True if check_templates == 'y' else False
 
+                    print("Would you like to capture, process and display on separate threads?(y/n):")
+                    pipeline = input()
+                    pipeline = True if pipeline == 'y' else False
+
                     ComputerVision.display(foregroundClassifier=foregroundClassifier,
                                         edgeClassifier=edgeClassifier,
                                         videoPath = available_videos[selection], 
                                         saveTemplate = save_templates, 
-                                        checkTemplate = check_templates)
+                                        checkTemplate = check_templates,
+                                        pipeline = pipeline)
                 else:
 
                     print("Incorrect selection.")
@@ -121,7 +126,12 @@ def systemUserInterface(templates, database, foregroundClassifier, edgeClassifie
 
             if database.connected():
                 databaseUserInterface(database)
-                templates = database.load_templates(templates)
+
+                # Only the templates changed in the database menu are fetched and applied to the classifiers.
+                if templateSync is not None:
+                    templateSync.refresh()
+                else:
+                    templates = database.load_templates(templates)
 
             else:
                 print("Database not connected.")
@@ -151,6 +161,7 @@ def databaseUserInterface(database):
         3                               Access template image by template_id.\n
         4                               Upload all templates locally.\n
         5                               Delete all entries.\n
+        6                               Upload templates saved by a recording session.\n
         Previous Menu(r)                Returns to preivous menu.
         """)
 
@@ -191,6 +202,12 @@ def databaseUserInterface(database):
             for template_id in id_list:
                 database.delete_template(template_id)
 
+        elif command == "6":
+
+            session_name = input("Enter the session name the templates were saved under: ")
+            template_type = input("Please enter the template_type: ")
+            database.upload_session_templates(session_name, template_type)
+
         elif command == "r":
 
             show_UI = False
@@ -48,18 +48,25 @@ def main():
         for template_type in template_types:
             templates[template_characteristic][template_type] = []
 
+    template_sync = None
     if database.connected():
-        templates = database.load_templates(templates)
+        template_sync = Templates.TemplateSync(database, templates)
+        template_sync.refresh()
     else:
         templates = Templates.loadTemplatesLocally()
 
     edge_classifier = HumanStateClassifier.KNeighborsClassifier(templates['edge'], k=20)
     foreground_classifier = HumanStateClassifier.KNeighborsClassifier(templates["foreground"], k=20)
 
+    if template_sync is not None:
+        template_sync.track('edge', edge_classifier)
+        template_sync.track('foreground', foreground_classifier)
+
     UserInterface.systemUserInterface(templates,
                                     database,
                                     edgeClassifier=edge_classifier,
-                                    foregroundClassifier=foreground_classifier)
+                                    foregroundClassifier=foreground_classifier,
+                                    templateSync=template_sync)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file